@@ -1,20 +1,40 @@
 import gc
+import importlib.util
+import io
+import os
 import re
-from contextlib import nullcontext
+from concurrent.futures import Executor, Future
+from contextlib import (AbstractContextManager, contextmanager, nullcontext,
+                        redirect_stdout)
 from datetime import datetime
+from pathlib import Path
 
 import numpy as np
 import torch
 from PIL import Image as PilImage
 from PIL.ImageOps import exif_transpose
+from torchvision.io import ImageReadMode, decode_jpeg
 from transformers import (AutoModelForVision2Seq, AutoProcessor,
                           BatchFeature, BitsAndBytesConfig)
 from transformers.utils.import_utils import is_torch_bf16_gpu_available
 
 import auto_captioning.captioning_thread as captioning_thread
-from utils.enums import CaptionDevice
+from auto_captioning.image_cache import ImageCache
+from utils.enums import CaptionDevice, CaptionQuantization
 from utils.image import Image
 
+EXIF_ORIENTATION_TAG = 0x0112
+# The number of input tokens that are decoded together with the generated
+# tokens. Tokenizers can decode the first tokens of a sequence differently (for
+# example, without a leading space), so the generated tokens are decoded after
+# some of the input tokens and the text of the input tokens is removed.
+DECODING_CONTEXT_TOKEN_COUNT = 8
+
+# Use TensorFloat-32 for float32 matrix multiplications and let cuDNN select
+# the fastest convolution algorithms for the vision encoders.
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.benchmark = True
+
 
 def replace_template_variable(match: re.Match, image: Image) -> str:
     template_variable = match.group(0)[1:-1].lower()
@@ -35,11 +55,30 @@ def replace_template_variables(text: str, image: Image) -> str:
     return text
 
 
+@contextmanager
+def suppress_stdout():
+    # Write to a null file instead of setting `sys.stdout` to `None` so that
+    # any code writing to `sys.stdout` directly still works.
+    with open(os.devnull, 'w') as null_file, redirect_stdout(null_file):
+        yield
+
+
 class AutoCaptioningModel:
-    dtype = torch.float16
-    model_load_context_manager = nullcontext()
+    # Bfloat16 falls back to float16 on GPUs that do not support it.
+    dtype = torch.bfloat16
     transformers_model_class = AutoModelForVision2Seq
     image_mode = 'RGB'
+    # Whether multiple images can be passed to the processor and the model at
+    # once.
+    supports_batching = True
+    # Whether the model decodes JPEG images on the GPU with
+    # `load_image_tensor()`.
+    decodes_jpeg_images_on_gpu = False
+    # Whether `generate()` returns the input tokens in front of the generated
+    # tokens. This is the case for decoder-only models that are passed
+    # `input_ids`, but not for encoder-decoder models, models that are passed
+    # embeddings, or BLIP-2 and InstructBLIP, which only add a BOS token.
+    generate_returns_input_token_ids = False
 
     def __init__(self,
                  captioning_thread_: 'captioning_thread.CaptioningThread',
@@ -57,15 +96,32 @@ class AutoCaptioningModel:
                 self.dtype = torch.float16
         self.dtype_argument = ({'dtype': self.dtype}
                                if self.device.type == 'cuda' else {})
-        self.load_in_4_bit = caption_settings['load_in_4_bit']
+        self.quantization: CaptionQuantization = (
+            caption_settings['quantization'])
+        self.load_in_4_bit = self.quantization == CaptionQuantization.FOUR_BIT
+        self.load_in_8_bit = (self.quantization
+                              == CaptionQuantization.EIGHT_BIT)
         self.bad_words_string = caption_settings['bad_words']
         self.forced_words_string = caption_settings['forced_words']
         self.remove_tag_separators = caption_settings['remove_tag_separators']
         self.generation_parameters = caption_settings['generation_parameters']
         self.beam_count = self.generation_parameters['num_beams']
+        self.batch_size = caption_settings['batch_size']
+        self.compile_model = caption_settings['compile_model']
+        self.use_static_cache = False
         self.processor = None
         self.model = None
         self.tokenizer = None
+        # Images that are being loaded in the background, keyed by path.
+        self.image_futures: dict[Path, Future] = {}
+        # The keyword arguments passed to `generate()` are the same for every
+        # image, so they are only built for the first image.
+        self.generation_arguments: dict | None = None
+        # Copy the model inputs to the GPU on a separate stream so that the
+        # transfer can overlap with computation on the default stream.
+        self.copy_stream = (torch.cuda.Stream(self.device)
+                            if self.device.type == 'cuda' else None)
+        self.copy_event = None
 
     def get_device(self) -> torch.device:
         if (self.device_setting == CaptionDevice.GPU
@@ -86,11 +142,21 @@ class AutoCaptioningModel:
         return self.get_additional_error_message()
 
     def get_processor(self):
-        return AutoProcessor.from_pretrained(self.model_id,
-                                             trust_remote_code=True)
+        try:
+            # Use the faster torchvision-based image processor if the model
+            # has one.
+            return AutoProcessor.from_pretrained(
+                self.model_id, trust_remote_code=True, use_fast=True)
+        except (ValueError, TypeError):
+            return AutoProcessor.from_pretrained(self.model_id,
+                                                 trust_remote_code=True)
 
     def get_model_load_arguments(self) -> dict:
-        arguments = {'device_map': self.device, 'trust_remote_code': True}
+        # Safetensors weights are memory-mapped instead of unpickled, which
+        # makes loading faster. `load_model()` falls back to `.bin` weights
+        # for checkpoints that do not have safetensors weights.
+        arguments = {'device_map': self.device, 'use_safetensors': True,
+                     'trust_remote_code': True}
         if self.load_in_4_bit:
             quantization_config = BitsAndBytesConfig(
                 load_in_4bit=True,
@@ -99,14 +165,47 @@ class AutoCaptioningModel:
                 bnb_4bit_use_double_quant=True
             )
             arguments['quantization_config'] = quantization_config
-        elif self.device.type == 'cuda':
+        elif self.load_in_8_bit:
+            arguments['quantization_config'] = BitsAndBytesConfig(
+                load_in_8bit=True)
+        if self.device.type == 'cuda':
+            # Also pass the dtype when quantizing so that the weights that are
+            # not quantized use the same dtype as the computation instead of
+            # the quantizer's default of float16.
             arguments['torch_dtype'] = self.dtype
+            arguments['attn_implementation'] = 'sdpa'
         return arguments
 
+    @staticmethod
+    def get_model_load_context_manager() -> AbstractContextManager:
+        return nullcontext()
+
     def load_model(self, model_load_arguments: dict):
-        with self.model_load_context_manager:
-            model = self.transformers_model_class.from_pretrained(
-                self.model_id, **model_load_arguments)
+        with self.get_model_load_context_manager():
+            while True:
+                try:
+                    model = self.transformers_model_class.from_pretrained(
+                        self.model_id, **model_load_arguments)
+                    break
+                except (OSError, ValueError) as exception:
+                    # Fall back to `.bin` weights for checkpoints that do not
+                    # have safetensors weights, and to the default attention
+                    # implementation for models that do not support SDPA.
+                    if (isinstance(exception, OSError)
+                            and 'safetensors' in str(exception)
+                            and 'use_safetensors' in model_load_arguments):
+                        fallback_key = 'use_safetensors'
+                    elif (isinstance(exception, ValueError)
+                          and 'scaled_dot_product_attention' in str(exception)
+                          and 'attn_implementation' in model_load_arguments):
+                        fallback_key = 'attn_implementation'
+                    else:
+                        raise
+                    model_load_arguments = {
+                        key: value
+                        for key, value in model_load_arguments.items()
+                        if key != fallback_key
+                    }
         model.eval()
         return model
 
@@ -133,13 +232,17 @@ class AutoCaptioningModel:
         # If the processor and model were previously loaded, use them.
         processor = self.thread_parent.processor
         model = self.thread_parent.model
-        # Only GPUs support 4-bit quantization.
-        self.load_in_4_bit = self.load_in_4_bit and self.device.type == 'cuda'
+        # Only GPUs support quantization.
+        if self.device.type != 'cuda':
+            self.quantization = CaptionQuantization.NONE
+            self.load_in_4_bit = False
+            self.load_in_8_bit = False
         if (model and self.thread_parent.model_id == self.model_id
-                and (self.thread_parent.model_device_type
-                     == self.device.type)
-                and (self.thread_parent.is_model_loaded_in_4_bit
-                     == self.load_in_4_bit)):
+                # Compare the full device so that a model on a different GPU
+                # is not reused.
+                and self.thread_parent.model_device == self.device
+                and (self.thread_parent.model_quantization
+                     == self.quantization)):
             self.processor = processor
             self.model = model
             return
@@ -159,12 +262,48 @@ class AutoCaptioningModel:
         self.model = self.get_model()
         self.thread_parent.model = self.model
         self.thread_parent.model_id = self.model_id
-        self.thread_parent.model_device_type = self.device.type
-        self.thread_parent.is_model_loaded_in_4_bit = self.load_in_4_bit
+        self.thread_parent.model_device = self.device
+        self.thread_parent.model_quantization = self.quantization
+        self.thread_parent.is_model_compiled = False
+        self.thread_parent.uncompiled_forward = None
 
     def monkey_patch_after_loading(self):
         pass
 
+    def compile_generation_model(self):
+        """
+        Compile the forward pass of the generation model and use a static
+        key-value cache so that CUDA graphs can be reused between generation
+        steps. The compiled model is kept together with the loaded model, and
+        the original forward pass is restored if compilation is turned off.
+        """
+        generation_model = self.get_generation_model()
+        if (self.compile_model and self.device.type == 'cuda'
+                and importlib.util.find_spec('triton') is None):
+            # Compiling with `mode='reduce-overhead'` requires Triton, which is
+            # not available on every platform.
+            print('Triton is not installed, so the model cannot be compiled. '
+                  'Captioning without compiling the model...')
+            self.compile_model = False
+        if not self.compile_model or self.device.type != 'cuda':
+            if self.thread_parent.is_model_compiled:
+                generation_model.forward = (
+                    self.thread_parent.uncompiled_forward)
+                self.thread_parent.uncompiled_forward = None
+                self.thread_parent.is_model_compiled = False
+            return
+        if not getattr(generation_model, '_supports_static_cache', False):
+            print('This model does not support compilation. Captioning '
+                  'without compiling the model...')
+            return
+        self.use_static_cache = True
+        if self.thread_parent.is_model_compiled:
+            return
+        self.thread_parent.uncompiled_forward = generation_model.forward
+        generation_model.forward = torch.compile(generation_model.forward,
+                                                 mode='reduce-overhead')
+        self.thread_parent.is_model_compiled = True
+
     @staticmethod
     def get_captioning_start_datetime_string(
             captioning_start_datetime: datetime) -> str:
@@ -204,20 +343,173 @@ class AutoCaptioningModel:
             text = image_prompt or self.caption_start
         return text
 
-    def load_image(self, image: Image) -> PilImage:
-        pil_image = PilImage.open(image.path)
+    def decode_image(self, image_bytes: bytes) -> PilImage:
+        pil_image = PilImage.open(io.BytesIO(image_bytes))
+        pil_image.load()
         # Rotate the image according to the orientation tag.
         pil_image = exif_transpose(pil_image)
         pil_image = pil_image.convert(self.image_mode)
         return pil_image
 
+    def read_image(self, image: Image) -> PilImage:
+        # Read the whole file at once so that the file handle is not kept
+        # open while the image is decoded.
+        return self.decode_image(image.path.read_bytes())
+
+    def can_decode_image_on_gpu(self, image: Image) -> bool:
+        return (self.decodes_jpeg_images_on_gpu and self.device.type == 'cuda'
+                and self.image_mode == 'RGB'
+                and image.path.suffix.lower() in ('.jpg', '.jpeg'))
+
+    @staticmethod
+    def is_gpu_decodable_jpeg(image_bytes: bytes) -> bool:
+        # Only the header is read here, not the pixel data.
+        with PilImage.open(io.BytesIO(image_bytes)) as pil_image:
+            # Rotated images and CMYK images are handled by PIL.
+            return (pil_image.format == 'JPEG'
+                    and pil_image.mode in ('L', 'RGB')
+                    and pil_image.getexif().get(EXIF_ORIENTATION_TAG, 1) == 1)
+
+    def prefetch_image(self, image: Image) -> PilImage | bytes:
+        """
+        Load an image in the background. The images that
+        `load_image_tensor()` decodes on the GPU are only read, and their
+        bytes are returned instead of an image decoded by PIL.
+        """
+        image_bytes = image.path.read_bytes()
+        if (self.can_decode_image_on_gpu(image)
+                and self.is_gpu_decodable_jpeg(image_bytes)):
+            return image_bytes
+        return self.decode_image(image_bytes)
+
+    def prefetch_images(self, images: list[Image], executor: Executor):
+        """
+        Start loading images in the background so that they are already
+        decoded when `load_image()` is called for them.
+        """
+        image_cache = self.thread_parent.image_cache
+        for image in images:
+            if ImageCache.get_key(image.path, self.image_mode) in image_cache:
+                continue
+            self.image_futures[image.path] = executor.submit(
+                self.prefetch_image, image)
+
+    def load_image(self, image: Image) -> PilImage:
+        image_cache = self.thread_parent.image_cache
+        image_cache_key = ImageCache.get_key(image.path, self.image_mode)
+        image_future = self.image_futures.pop(image.path, None)
+        pil_image = image_cache.get(image_cache_key)
+        if pil_image is not None:
+            # Do not keep a prefetched copy of a cached image.
+            if image_future is not None:
+                image_future.cancel()
+            return pil_image
+        if image_future is None:
+            pil_image = self.read_image(image)
+        else:
+            pil_image = image_future.result()
+            if isinstance(pil_image, bytes):
+                pil_image = self.decode_image(pil_image)
+        image_cache.add(image_cache_key, pil_image)
+        return pil_image
+
+    def load_image_tensor(self, image: Image) -> torch.Tensor | None:
+        """
+        Decode a JPEG image directly on the GPU into an RGB `uint8` tensor.
+        Return `None` if the image has to be loaded with `load_image()`
+        instead. Images decoded on the GPU are not added to the image cache
+        because the decoded tensors would take up GPU memory, but images that
+        are already in the cache are loaded from it.
+        """
+        if (not self.can_decode_image_on_gpu(image)
+                or ImageCache.get_key(image.path, self.image_mode)
+                in self.thread_parent.image_cache):
+            return None
+        image_future = self.image_futures.get(image.path)
+        if image_future is None:
+            image_bytes = image.path.read_bytes()
+            if not self.is_gpu_decodable_jpeg(image_bytes):
+                return None
+        else:
+            prefetched_image = image_future.result()
+            # Prefetched images that cannot be decoded on the GPU are already
+            # decoded by PIL and are used by `load_image()`.
+            if not isinstance(prefetched_image, bytes):
+                return None
+            del self.image_futures[image.path]
+            image_bytes = prefetched_image
+        image_data = torch.frombuffer(bytearray(image_bytes),
+                                      dtype=torch.uint8)
+        return decode_jpeg(image_data, mode=ImageReadMode.RGB,
+                           device=self.device)
+
+    def move_model_inputs_to_device(
+            self, model_inputs: BatchFeature) -> BatchFeature:
+        if self.copy_stream is None:
+            return model_inputs.to(self.device, **self.dtype_argument)
+        compute_stream = torch.cuda.current_stream(self.device)
+        device_model_inputs = {}
+        with torch.cuda.stream(self.copy_stream):
+            for key, value in model_inputs.items():
+                if not isinstance(value, torch.Tensor):
+                    device_model_inputs[key] = value
+                    continue
+                # Copies from pinned memory can run asynchronously with
+                # respect to the CPU. `BatchFeature.to()` is not used because
+                # it ignores `non_blocking` for integer tensors.
+                value = value.pin_memory().to(self.device, non_blocking=True)
+                # Cast on the GPU instead of on the CPU.
+                if value.is_floating_point():
+                    value = value.to(self.dtype)
+                # The tensors are allocated on the copy stream but used on the
+                # compute stream, so their memory must not be reused before
+                # the compute stream is done with them.
+                value.record_stream(compute_stream)
+                device_model_inputs[key] = value
+        self.copy_event = self.copy_stream.record_event()
+        return BatchFeature(device_model_inputs)
+
+    def wait_for_model_inputs_copy(self):
+        if self.copy_event is None:
+            return
+        torch.cuda.current_stream(self.device).wait_event(self.copy_event)
+        self.copy_event = None
+
     def get_model_inputs(self, image_prompt: str,
                          image: Image) -> BatchFeature | dict | np.ndarray:
         text = self.get_input_text(image_prompt)
         pil_image = self.load_image(image)
-        model_inputs = (self.processor(text=text, images=pil_image,
-                                       return_tensors='pt')
-                        .to(self.device, **self.dtype_argument))
+        model_inputs = self.processor(text=text, images=pil_image,
+                                      return_tensors='pt')
+        model_inputs = self.move_model_inputs_to_device(model_inputs)
+        return model_inputs
+
+    def get_batch_size(self) -> int:
+        return self.batch_size if self.supports_batching else 1
+
+    def get_batch_model_inputs(self, image_prompts: list[str],
+                               pil_images: list[PilImage]) -> BatchFeature:
+        texts = [self.get_input_text(image_prompt)
+                 for image_prompt in image_prompts]
+        # The processor is kept between captioning runs, so the padding
+        # settings of its tokenizer are restored afterwards.
+        tokenizer = self.processor.tokenizer
+        padding_side = tokenizer.padding_side
+        pad_token = tokenizer.pad_token
+        # Pad on the left so that the generated tokens directly follow the
+        # input tokens of every image.
+        tokenizer.padding_side = 'left'
+        # Some tokenizers, such as those of Llama 3 based models, do not have
+        # a padding token.
+        if pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        try:
+            model_inputs = self.processor(text=texts, images=pil_images,
+                                          padding=True, return_tensors='pt')
+        finally:
+            tokenizer.padding_side = padding_side
+            tokenizer.pad_token = pad_token
+        model_inputs = self.move_model_inputs_to_device(model_inputs)
         return model_inputs
 
     def get_generation_model(self):
@@ -264,24 +556,63 @@ class AutoCaptioningModel:
     def get_additional_generation_parameters() -> dict:
         return {}
 
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        return image_prompt
-
     @staticmethod
     def postprocess_generated_text(generated_text: str) -> str:
         return generated_text
 
+    @staticmethod
+    def remove_input_token_ids(generated_token_ids: torch.Tensor,
+                               input_length: int) -> tuple[torch.Tensor, int]:
+        """
+        Remove the `input_length` input tokens at the start of the generated
+        tokens, so that the prompt is not decoded. The last input tokens are
+        kept as context for decoding the new tokens. Return the remaining
+        tokens and the number of input tokens kept.
+        """
+        if not input_length:
+            return generated_token_ids, 0
+        context_token_count = min(DECODING_CONTEXT_TOKEN_COUNT, input_length)
+        context_start_index = input_length - context_token_count
+        return (generated_token_ids[:, context_start_index:],
+                context_token_count)
+
+    def decode_token_ids(self, token_ids: torch.Tensor) -> str:
+        """Decode a single sequence of token IDs into text."""
+        # Some processors only implement `batch_decode()`.
+        decode = getattr(self.processor, 'decode', None)
+        if decode is None:
+            return self.processor.batch_decode(token_ids.unsqueeze(0),
+                                               skip_special_tokens=True)[0]
+        return decode(token_ids, skip_special_tokens=True)
+
     def get_caption_from_generated_tokens(
-            self, generated_token_ids: torch.Tensor, image_prompt: str) -> str:
-        generated_text = self.processor.batch_decode(
-            generated_token_ids, skip_special_tokens=True)[0]
-        image_prompt = self.postprocess_image_prompt(image_prompt)
+            self, generated_token_ids: torch.Tensor,
+            context_token_count: int = 0) -> str:
+        """
+        Get the caption from the generated tokens of a single image. The
+        first `context_token_count` tokens are the last input tokens.
+        """
+        generated_text = self.decode_token_ids(generated_token_ids[0])
+        # Whether the generated text directly continues the input text, which
+        # ends with the caption start.
+        is_continuation = False
+        if context_token_count:
+            context_text = self.decode_token_ids(
+                generated_token_ids[0, :context_token_count])
+            if generated_text.startswith(context_text):
+                generated_text = generated_text[len(context_text):]
+                is_continuation = True
+            else:
+                generated_text = self.decode_token_ids(
+                    generated_token_ids[0, context_token_count:])
         generated_text = self.postprocess_generated_text(generated_text)
-        if image_prompt.strip() and generated_text.startswith(image_prompt):
-            caption = generated_text[len(image_prompt):]
+        if is_continuation:
+            # Join the caption start and the generated text without a
+            # separator because the model can continue in the middle of a
+            # word.
+            caption = self.caption_start + generated_text
         elif (self.caption_start.strip()
-              and generated_text.startswith(self.caption_start)):
+                and generated_text.startswith(self.caption_start)):
             caption = generated_text
         else:
             caption = f'{self.caption_start.strip()} {generated_text.strip()}'
@@ -290,20 +621,50 @@ class AutoCaptioningModel:
             caption = caption.replace(self.thread.tag_separator, ' ')
         return caption
 
+    def generate_token_ids(self, model_inputs: BatchFeature | dict | np.ndarray
+                           ) -> tuple[torch.Tensor, int]:
+        """
+        Return the generated tokens and the number of input tokens that were
+        kept at the start of them.
+        """
+        generation_model = self.get_generation_model()
+        if self.generation_arguments is None:
+            self.tokenizer = self.get_tokenizer()
+            self.generation_arguments = {
+                'bad_words_ids': self.get_bad_words_ids(),
+                'force_words_ids': self.get_forced_words_ids(),
+                **self.generation_parameters,
+                **self.get_additional_generation_parameters()
+            }
+            if self.use_static_cache:
+                self.generation_arguments['cache_implementation'] = 'static'
+        # Record the input length before generating because some models
+        # modify `input_ids` in place.
+        input_length = (model_inputs['input_ids'].shape[1]
+                        if self.generate_returns_input_token_ids else 0)
+        self.wait_for_model_inputs_copy()
+        generated_token_ids = generation_model.generate(
+            **model_inputs, **self.generation_arguments)
+        return self.remove_input_token_ids(generated_token_ids, input_length)
+
     def generate_caption(self, model_inputs: BatchFeature | dict | np.ndarray,
                          image_prompt: str) -> tuple[str, str]:
-        generation_model = self.get_generation_model()
-        self.tokenizer = self.get_tokenizer()
-        bad_words_ids = self.get_bad_words_ids()
-        forced_words_ids = self.get_forced_words_ids()
-        additional_generation_parameters = (
-            self.get_additional_generation_parameters())
-        with torch.inference_mode():
-            generated_token_ids = generation_model.generate(
-                **model_inputs, bad_words_ids=bad_words_ids,
-                force_words_ids=forced_words_ids, **self.generation_parameters,
-                **additional_generation_parameters)
+        generated_token_ids, context_token_count = self.generate_token_ids(
+            model_inputs)
+        del model_inputs
         caption = self.get_caption_from_generated_tokens(generated_token_ids,
-                                                         image_prompt)
+                                                         context_token_count)
         console_output_caption = caption
         return caption, console_output_caption
+
+    def generate_batch_captions(self,
+                                model_inputs: BatchFeature) -> list[str]:
+        generated_token_ids, context_token_count = self.generate_token_ids(
+            model_inputs)
+        del model_inputs
+        captions = [
+            self.get_caption_from_generated_tokens(token_ids.unsqueeze(0),
+                                                   context_token_count)
+            for token_ids in generated_token_ids
+        ]
+        return captions
@@ -1,7 +1,11 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from time import perf_counter
 
+import torch
 from PIL import UnidentifiedImageError
 from PySide6.QtCore import QModelIndex, QThread, Qt, Signal
 
@@ -10,30 +14,35 @@ from auto_captioning.models_list import get_model_class
 from models.image_list_model import ImageListModel
 from utils.enums import CaptionPosition
 from utils.image import Image
-from utils.settings import get_tag_separator
+
+# The minimum number of seconds between progress bar updates.
+PROGRESS_BAR_UPDATE_INTERVAL = 0.2
+# The number of images after which cached GPU memory that is no longer used is
+# released.
+CUDA_CACHE_CLEAR_INTERVAL = 32
 
 
 def add_caption_to_tags(tags: list[str], caption: str,
-                        caption_position: CaptionPosition) -> list[str]:
+                        caption_position: CaptionPosition,
+                        tag_separator: str) -> list[str]:
     if caption_position == CaptionPosition.DO_NOT_ADD or not caption:
         return tags
-    tag_separator = get_tag_separator()
     new_tags = caption.split(tag_separator)
-    # Make a copy of the tags so that the tags in the image list model are not
+    # Build a new list so that the tags in the image list model are not
     # modified.
-    tags = tags.copy()
     if caption_position == CaptionPosition.BEFORE_FIRST_TAG:
-        tags[:0] = new_tags
-    elif caption_position == CaptionPosition.AFTER_LAST_TAG:
-        tags.extend(new_tags)
-    elif caption_position == CaptionPosition.OVERWRITE_FIRST_TAG:
-        if tags:
-            tags[:1] = new_tags
-        else:
-            tags = new_tags
-    elif caption_position == CaptionPosition.OVERWRITE_ALL_TAGS:
-        tags = new_tags
-    return tags
+        return new_tags + tags
+    if caption_position == CaptionPosition.AFTER_LAST_TAG:
+        return tags + new_tags
+    if caption_position == CaptionPosition.OVERWRITE_FIRST_TAG:
+        return new_tags + tags[1:]
+    # `CaptionPosition.OVERWRITE_ALL_TAGS`
+    return new_tags
+
+
+def print_unsupported_image_message(image: Image):
+    print(f'Skipping {image.path.name} because its file format is not '
+          f'supported or it is a corrupted image.')
 
 
 def format_duration(seconds: float) -> str:
@@ -55,10 +64,9 @@ def format_duration(seconds: float) -> str:
 class CaptioningThread(QThread):
     text_outputted = Signal(str)
     clear_console_text_edit_requested = Signal()
-    # The image index, the caption, and the tags with the caption added. The
-    # third parameter must be declared as `list` instead of `list[str]` for it
-    # to work.
-    caption_generated = Signal(QModelIndex, str, list)
+    # A list of tuples of the image index, the caption, and the tags with the
+    # caption added, emitted once per batch of images.
+    captions_generated = Signal(list)
     progress_bar_update_requested = Signal(int)
 
     def __init__(self, parent, image_list_model: ImageListModel,
@@ -73,6 +81,16 @@ class CaptioningThread(QThread):
         self.models_directory_path = models_directory_path
         self.is_error = False
         self.is_canceled = False
+        # Used to decode the images of the next batch in the background while
+        # the current batch is being captioned.
+        self.image_loading_executor = ThreadPoolExecutor(
+            max_workers=max(1, (os.cpu_count() or 1) // 2))
+        # Text written to `stdout` and `stderr` is collected into whole lines
+        # before it is emitted, because each emission is a cross-thread
+        # signal. Other threads can also write while the streams are
+        # redirected, so the buffer is protected by a lock.
+        self.output_buffer: list[str] = []
+        self.output_lock = threading.Lock()
 
     def run_captioning(self):
         model_id = self.caption_settings['model_id']
@@ -87,6 +105,7 @@ class CaptioningThread(QThread):
             return
         model.load_processor_and_model()
         model.monkey_patch_after_loading()
+        model.compile_generation_model()
         if self.is_canceled:
             print('Canceled captioning.')
             return
@@ -97,34 +116,74 @@ class CaptioningThread(QThread):
         captioning_message = model.get_captioning_message(
             are_multiple_images_selected, captioning_start_datetime)
         print(captioning_message)
+        if (self.caption_settings['batch_size'] > 1
+                and not model.supports_batching):
+            print('This model does not support batching, so the images are '
+                  'captioned one at a time.')
         caption_position = self.caption_settings['caption_position']
-        for i, image_index in enumerate(self.selected_image_indices):
+        batch_size = model.get_batch_size()
+        last_progress_bar_update_time = 0
+        # Bind the attributes that are used for every image to local variables
+        # to avoid repeated lookups in the loop.
+        selected_image_indices = self.selected_image_indices
+        image_loading_executor = self.image_loading_executor
+        tag_separator = self.tag_separator
+        emit_captions_generated = self.captions_generated.emit
+        model.prefetch_images(self.get_images(0, batch_size),
+                              image_loading_executor)
+        for batch_start_index in range(0, selected_image_count, batch_size):
             start_time = perf_counter()
             if self.is_canceled:
                 print('Canceled captioning.')
                 return
-            image: Image = self.image_list_model.data(image_index,
-                                                      Qt.ItemDataRole.UserRole)
-            image_prompt = model.get_image_prompt(image)
-            try:
-                model_inputs = model.get_model_inputs(image_prompt, image)
-            except UnidentifiedImageError:
-                print(f'Skipping {image.path.name} because its file format is '
-                      'not supported or it is a corrupted image.')
-                continue
-            caption, console_output_caption = model.generate_caption(
-                model_inputs, image_prompt)
-            tags = add_caption_to_tags(image.tags, caption, caption_position)
-            self.caption_generated.emit(image_index, caption, tags)
-            if are_multiple_images_selected:
-                self.progress_bar_update_requested.emit(i + 1)
-            if i == 0 and not are_multiple_images_selected:
-                self.clear_console_text_edit_requested.emit()
-            if console_output_caption is None:
-                console_output_caption = caption
-            print(f'{image.path.name} ({perf_counter() - start_time:.1f} s):\n'
-                  f'{console_output_caption}')
+            image_indices = selected_image_indices[
+                batch_start_index:batch_start_index + batch_size]
+            images = self.get_images(batch_start_index, batch_size)
+            next_batch_start_index = batch_start_index + batch_size
+            if next_batch_start_index < selected_image_count:
+                model.prefetch_images(
+                    self.get_images(next_batch_start_index, batch_size),
+                    image_loading_executor)
+            image_prompts = [model.get_image_prompt(image)
+                             for image in images]
+            captions = self.generate_captions(model, images, image_prompts)
+            if (model.device.type == 'cuda'
+                    and batch_start_index // CUDA_CACHE_CLEAR_INTERVAL
+                    != next_batch_start_index // CUDA_CACHE_CLEAR_INTERVAL):
+                torch.cuda.empty_cache()
+            # Show the average duration per image for batches.
+            duration = (perf_counter() - start_time) / len(images)
+            generated_captions = []
+            for batch_index, (image_index, image, caption_and_output) in (
+                    enumerate(zip(image_indices, images, captions))):
+                if caption_and_output is None:
+                    continue
+                caption, console_output_caption = caption_and_output
+                i = batch_start_index + batch_index
+                tags = add_caption_to_tags(image.tags, caption,
+                                           caption_position,
+                                           tag_separator)
+                generated_captions.append((image_index, caption, tags))
+                if are_multiple_images_selected:
+                    # Limit how often the progress bar is updated when
+                    # captioning many images quickly.
+                    current_time = perf_counter()
+                    if (current_time - last_progress_bar_update_time
+                            >= PROGRESS_BAR_UPDATE_INTERVAL):
+                        self.progress_bar_update_requested.emit(i + 1)
+                        last_progress_bar_update_time = current_time
+                if i == 0 and not are_multiple_images_selected:
+                    self.clear_console_text_edit_requested.emit()
+                if console_output_caption is None:
+                    console_output_caption = caption
+                print(f'{image.path.name} ({duration:.1f} s):\n'
+                      f'{console_output_caption}')
+            if generated_captions:
+                emit_captions_generated(generated_captions)
         if are_multiple_images_selected:
+            # Update the progress bar after the loop because the last images
+            # may have been skipped or throttled.
+            self.progress_bar_update_requested.emit(selected_image_count)
             captioning_end_datetime = datetime.now()
             total_captioning_duration = ((captioning_end_datetime
                                           - captioning_start_datetime)
@@ -136,6 +195,56 @@ class CaptioningThread(QThread):
                   f'({average_captioning_duration:.1f} s/image) at '
                   f'{captioning_end_datetime.strftime("%Y-%m-%d %H:%M:%S")}.')
 
+    def get_images(self, start_index: int, count: int) -> list[Image]:
+        image_indices = self.selected_image_indices[start_index:
+                                                    start_index + count]
+        get_data = self.image_list_model.data
+        return [get_data(image_index, Qt.ItemDataRole.UserRole)
+                for image_index in image_indices]
+
+    # Preparing the model inputs is also done in inference mode so that no
+    # autograd bookkeeping is done for the input tensors.
+    @staticmethod
+    @torch.inference_mode()
+    def generate_captions(
+            model: AutoCaptioningModel, images: list[Image],
+            image_prompts: list[str]) -> list[tuple[str, str | None] | None]:
+        """
+        Generate the captions and console output captions for a batch of
+        images. `None` is returned in place of them for images that could not
+        be loaded.
+        """
+        if len(images) == 1:
+            image, image_prompt = images[0], image_prompts[0]
+            try:
+                model_inputs = model.get_model_inputs(image_prompt, image)
+            except UnidentifiedImageError:
+                print_unsupported_image_message(image)
+                return [None]
+            return [model.generate_caption(model_inputs, image_prompt)]
+        loaded_image_prompts = []
+        pil_images = []
+        is_loaded = []
+        for image, image_prompt in zip(images, image_prompts):
+            try:
+                pil_images.append(model.load_image(image))
+            except UnidentifiedImageError:
+                print_unsupported_image_message(image)
+                is_loaded.append(False)
+                continue
+            loaded_image_prompts.append(image_prompt)
+            is_loaded.append(True)
+        if not pil_images:
+            return [None] * len(images)
+        model_inputs = model.get_batch_model_inputs(loaded_image_prompts,
+                                                    pil_images)
+        # Release the decoded images that are not cached as soon as they are
+        # no longer needed.
+        del pil_images
+        loaded_captions = iter(model.generate_batch_captions(model_inputs))
+        return [(next(loaded_captions), None) if is_image_loaded else None
+                for is_image_loaded in is_loaded]
+
     def run(self):
         try:
             self.run_captioning()
@@ -143,6 +252,29 @@ class CaptioningThread(QThread):
             self.is_error = True
             # Show the error message in the console text edit.
             raise exception
+        finally:
+            self.image_loading_executor.shutdown(cancel_futures=True)
+
+    def emit_output_buffer(self):
+        # Must be called with `self.output_lock` held.
+        if self.output_buffer:
+            self.text_outputted.emit(''.join(self.output_buffer))
+            self.output_buffer.clear()
 
     def write(self, text: str):
-        self.text_outputted.emit(text)
+        with self.output_lock:
+            # '\x1b[A' is the ANSI escape sequence for moving the cursor up. It
+            # must be emitted on its own to be recognized.
+            if text == '\x1b[A':
+                self.emit_output_buffer()
+                self.text_outputted.emit(text)
+                return
+            self.output_buffer.append(text)
+            # Progress bars redraw themselves with carriage returns instead of
+            # newlines.
+            if '\n' in text or '\r' in text:
+                self.emit_output_buffer()
+
+    def flush(self):
+        with self.output_lock:
+            self.emit_output_buffer()
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image as PilImage
+
+
+def get_pil_image_size(pil_image: PilImage.Image) -> int:
+    return pil_image.width * pil_image.height * len(pil_image.getbands())
+
+
+class ImageCache:
+    """
+    A least recently used cache of decoded images, so that captioning the same
+    images again (for example, to try a different prompt) does not require
+    decoding them again. The cached images are shared with the callers, so
+    they must not be modified or closed. The size limit can be changed from
+    the GUI thread while captioning, so the cache is protected by a lock.
+    """
+
+    def __init__(self, size_limit: int):
+        # The maximum total size in bytes of the cached images.
+        self.size_limit = size_limit
+        self.size = 0
+        self.pil_images: OrderedDict[tuple, PilImage.Image] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(path: Path, image_mode: str) -> tuple | None:
+        try:
+            # Include the modification time so that edited images are
+            # decoded again.
+            modification_time = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        return path, modification_time, image_mode
+
+    def __contains__(self, key: tuple | None) -> bool:
+        with self.lock:
+            return key in self.pil_images
+
+    def get(self, key: tuple | None) -> PilImage.Image | None:
+        with self.lock:
+            pil_image = self.pil_images.get(key)
+            if pil_image is not None:
+                self.pil_images.move_to_end(key)
+            return pil_image
+
+    def remove_least_recently_used_images(self, size_limit: int):
+        # Must be called with `self.lock` held.
+        while self.size > size_limit:
+            _, removed_pil_image = self.pil_images.popitem(last=False)
+            self.size -= get_pil_image_size(removed_pil_image)
+
+    def add(self, key: tuple | None, pil_image: PilImage.Image):
+        if key is None:
+            return
+        image_size = get_pil_image_size(pil_image)
+        with self.lock:
+            if key in self.pil_images or image_size > self.size_limit:
+                return
+            self.remove_least_recently_used_images(
+                self.size_limit - image_size)
+            self.pil_images[key] = pil_image
+            self.size += image_size
+
+    def set_size_limit(self, size_limit: int):
+        with self.lock:
+            self.size_limit = size_limit
+            self.remove_least_recently_used_images(size_limit)
+
+    def clear(self):
+        with self.lock:
+            self.pil_images.clear()
+            self.size = 0
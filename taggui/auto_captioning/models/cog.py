@@ -1,12 +1,13 @@
 import sys
 from abc import ABC, abstractmethod
-from contextlib import redirect_stdout
+from contextlib import AbstractContextManager
 from inspect import getsource
 from pathlib import Path
 
 from transformers import AutoModelForCausalLM, LlamaTokenizer
 
-from auto_captioning.auto_captioning_model import AutoCaptioningModel
+from auto_captioning.auto_captioning_model import (AutoCaptioningModel,
+                                                   suppress_stdout)
 from utils.image import Image
 
 
@@ -34,6 +35,8 @@ def patch_cog_source_code() -> bool:
 
 class Cog(AutoCaptioningModel, ABC):
     transformers_model_class = AutoModelForCausalLM
+    supports_batching = False
+    generate_returns_input_token_ids = True
 
     @property
     @abstractmethod
@@ -108,15 +111,14 @@ class Cogvlm(Cog):
             lambda _, __, prompt_: format_cogvlm_prompt(prompt_,
                                                         self.caption_start))
 
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        return f'Question: {image_prompt} Answer:'
-
 
 class Cogagent(Cog):
-    model_load_context_manager = redirect_stdout(None)
     template_version = 'chat_old'
 
+    @staticmethod
+    def get_model_load_context_manager() -> AbstractContextManager:
+        return suppress_stdout()
+
     def monkey_patch_after_loading(self):
         """Monkey patch CogAgent to support beam search and `caption_start`."""
         cogagent_module = next(module
@@ -143,7 +145,3 @@ class Cogagent(Cog):
             'chat_old': lambda _, prompt_: format_cogagent_prompt(
                 prompt_, self.caption_start)
         }
-
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        return f'<EOI>Question: {image_prompt} Answer:'
@@ -1,9 +1,10 @@
 import importlib.util
 
 import torch
-from torchvision import transforms
+from torchvision.transforms import v2
 from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
 
+import auto_captioning.captioning_thread as captioning_thread
 from auto_captioning.auto_captioning_model import AutoCaptioningModel
 from auto_captioning.models.cog import patch_cog_source_code
 from utils.enums import CaptionDevice
@@ -15,6 +16,17 @@ VISION_TOKEN_TYPE_ID = 1
 
 class Cogvlm2(AutoCaptioningModel):
     transformers_model_class = AutoModelForCausalLM
+    supports_batching = False
+    decodes_jpeg_images_on_gpu = True
+    generate_returns_input_token_ids = True
+
+    def __init__(self,
+                 captioning_thread_: 'captioning_thread.CaptioningThread',
+                 caption_settings: dict):
+        super().__init__(captioning_thread_, caption_settings)
+        self.last_text = None
+        self.last_text_inputs = None
+        self.image_transform = None
 
     def get_additional_error_message(self) -> str | None:
         if not importlib.util.find_spec('triton'):
@@ -46,7 +58,7 @@ class Cogvlm2(AutoCaptioningModel):
 
     def get_model_load_arguments(self) -> dict:
         arguments = super().get_model_load_arguments()
-        if self.load_in_4_bit:
+        if 'quantization_config' in arguments:
             config = AutoConfig.from_pretrained(self.model_id,
                                                 trust_remote_code=True)
             config.quantization_config = arguments['quantization_config']
@@ -57,6 +69,20 @@ class Cogvlm2(AutoCaptioningModel):
     def patch_source_code(self) -> bool:
         return patch_cog_source_code()
 
+    def load_processor_and_model(self):
+        super().load_processor_and_model()
+        image_size = self.model.config.vision_config['image_size']
+        # The image is resized and normalized on the model's device, so only
+        # the `uint8` pixels have to be copied to the GPU.
+        self.image_transform = v2.Compose([
+            v2.Resize((image_size, image_size),
+                      interpolation=v2.InterpolationMode.BICUBIC,
+                      antialias=True),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize((0.48145466, 0.4578275, 0.40821073),
+                         (0.26862954, 0.26130258, 0.27577711))
+        ])
+
     @staticmethod
     def get_default_prompt() -> str:
         return 'Describe the image in one sentence.'
@@ -65,9 +91,11 @@ class Cogvlm2(AutoCaptioningModel):
     def format_prompt(prompt: str) -> str:
         return f'Question: {prompt} Answer:'
 
-    def get_model_inputs(self, image_prompt: str, image: Image) -> dict:
-        text = self.get_input_text(image_prompt)
-        pil_image = self.load_image(image)
+    def get_text_inputs(self, text: str) -> dict:
+        # The text is usually the same for every image, so the inputs for the
+        # last text are reused.
+        if text == self.last_text:
+            return self.last_text_inputs
         image_size = self.model.config.vision_config['image_size']
         patch_size = self.model.config.vision_config['patch_size']
         vision_tokens_count = ((image_size // patch_size // 2)
@@ -81,22 +109,29 @@ class Cogvlm2(AutoCaptioningModel):
         input_ids += text_ids
         token_type_ids += [LANGUAGE_TOKEN_TYPE_ID] * len(text_ids)
         attention_mask = [1] * len(input_ids)
-        transform = transforms.Compose([
-            transforms.Resize(
-                (image_size, image_size),
-                interpolation=transforms.InterpolationMode.BICUBIC
-            ),
-            transforms.ToTensor(),
-            transforms.Normalize((0.48145466, 0.4578275, 0.40821073),
-                                 (0.26862954, 0.26130258, 0.27577711))
-        ])
-        image = transform(pil_image)
-        inputs = {
+        text_inputs = {
             'input_ids': torch.tensor(input_ids).unsqueeze(0).to(self.device),
             'token_type_ids': torch.tensor(token_type_ids).unsqueeze(0).to(
                 self.device),
             'attention_mask': torch.tensor(attention_mask).unsqueeze(0).to(
-                self.device),
+                self.device)
+        }
+        self.last_text = text
+        self.last_text_inputs = text_inputs
+        return text_inputs
+
+    def get_model_inputs(self, image_prompt: str, image: Image) -> dict:
+        text = self.get_input_text(image_prompt)
+        # Decoding on the GPU skips both the CPU decode and the copy of the
+        # raw pixels to the GPU.
+        image_tensor = self.load_image_tensor(image)
+        if image_tensor is None:
+            pil_image = self.load_image(image)
+            image_tensor = v2.functional.pil_to_tensor(pil_image).to(
+                self.device)
+        image = self.image_transform(image_tensor)
+        inputs = {
+            **self.get_text_inputs(text),
             'images': [[image.to(self.device, **self.dtype_argument)]
                        for _ in range(self.beam_count)]
         }
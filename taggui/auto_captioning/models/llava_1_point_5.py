@@ -2,6 +2,8 @@ from auto_captioning.auto_captioning_model import AutoCaptioningModel
 
 
 class Llava1Point5(AutoCaptioningModel):
+    generate_returns_input_token_ids = True
+
     @staticmethod
     def get_default_prompt() -> str:
         return 'Describe the image in twenty words or less.'
@@ -9,7 +11,3 @@ class Llava1Point5(AutoCaptioningModel):
     @staticmethod
     def format_prompt(prompt: str) -> str:
         return f'USER: <image>\n{prompt}\nASSISTANT:'
-
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        return image_prompt.replace('<image>', ' ')
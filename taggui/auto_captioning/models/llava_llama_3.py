@@ -2,6 +2,8 @@ from auto_captioning.auto_captioning_model import AutoCaptioningModel
 
 
 class LlavaLlama3(AutoCaptioningModel):
+    generate_returns_input_token_ids = True
+
     @staticmethod
     def get_default_prompt() -> str:
         return 'Describe the image in one sentence.'
@@ -19,11 +21,3 @@ class LlavaLlama3(AutoCaptioningModel):
         eos_token_id = (self.tokenizer('<|eot_id|>', add_special_tokens=False)
                         .input_ids)[0]
         return {'eos_token_id': eos_token_id}
-
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        image_prompt = image_prompt.replace('<|start_header_id|>', '')
-        image_prompt = image_prompt.replace('<|end_header_id|>', '')
-        image_prompt = image_prompt.replace('<image>', '')
-        image_prompt = image_prompt.replace('<|eot_id|>', '')
-        return image_prompt
@@ -2,6 +2,8 @@ from auto_captioning.auto_captioning_model import AutoCaptioningModel
 
 
 class LlavaNext(AutoCaptioningModel):
+    generate_returns_input_token_ids = True
+
     def get_processor(self):
         processor = super().get_processor()
         processor.tokenizer.padding_side = 'left'
@@ -22,23 +24,12 @@ class LlavaNext34b(LlavaNext):
     def get_input_text(self, image_prompt: str) -> str:
         return image_prompt + self.caption_start
 
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        image_prompt = image_prompt.replace('<|im_start|>', '<|im_start|> ')
-        image_prompt = image_prompt.replace('<|im_end|>', '')
-        image_prompt = image_prompt.replace('<image>', ' ')
-        return image_prompt
-
 
 class LlavaNextMistral(LlavaNext):
     @staticmethod
     def format_prompt(prompt: str) -> str:
         return f'[INST] <image>\n{prompt} [/INST]'
 
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        return image_prompt.replace('<image>', ' ')
-
 
 class LlavaNextVicuna(LlavaNext):
     @staticmethod
@@ -47,7 +38,3 @@ class LlavaNextVicuna(LlavaNext):
                 f"intelligence assistant. The assistant gives helpful, "
                 f"detailed, and polite answers to the human's questions. "
                 f"USER: <image>\n{prompt} ASSISTANT:")
-
-    @staticmethod
-    def postprocess_image_prompt(image_prompt: str) -> str:
-        return image_prompt.replace('<image>', '')
@@ -12,6 +12,7 @@ from utils.image import Image
 
 class Moondream(AutoCaptioningModel):
     transformers_model_class = AutoModelForCausalLM
+    supports_batching = False
 
     @staticmethod
     def get_default_prompt() -> str:
@@ -32,6 +33,8 @@ class Moondream1(Moondream):
     def get_additional_error_message(self) -> str | None:
         if self.load_in_4_bit:
             return 'This model cannot be loaded in 4-bit.'
+        if self.load_in_8_bit:
+            return 'This model cannot be loaded in 8-bit.'
         if self.beam_count > 1:
             return 'This model only supports `Number of beams` set to 1.'
         return None
@@ -89,6 +92,8 @@ class Moondream2(Moondream):
     def get_additional_error_message(self) -> str | None:
         if self.load_in_4_bit:
             return 'This model cannot be loaded in 4-bit.'
+        if self.load_in_8_bit:
+            return 'This model cannot be loaded in 8-bit.'
         return None
 
     def get_processor(self):
@@ -91,6 +91,7 @@ class WdTaggerModel:
 
 class WdTagger(AutoCaptioningModel):
     image_mode = 'RGBA'
+    supports_batching = False
 
     def __init__(self,
                  captioning_thread_: 'captioning_thread.CaptioningThread',
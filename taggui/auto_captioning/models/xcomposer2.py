@@ -1,5 +1,5 @@
 import importlib.util
-from contextlib import redirect_stdout
+from contextlib import AbstractContextManager
 
 import numpy as np
 import torch
@@ -7,7 +7,9 @@ from PIL import Image as PilImage
 from torchvision.transforms import functional
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
-from auto_captioning.auto_captioning_model import AutoCaptioningModel
+import auto_captioning.captioning_thread as captioning_thread
+from auto_captioning.auto_captioning_model import (AutoCaptioningModel,
+                                                   suppress_stdout)
 from utils.enums import CaptionDevice
 from utils.image import Image
 
@@ -30,8 +32,21 @@ class InternLMXComposer2QuantizedForCausalLM(BaseGPTQForCausalLM):
 
 
 class Xcomposer2(AutoCaptioningModel):
-    model_load_context_manager = redirect_stdout(None)
+    # The GPTQ kernels of the 4-bit model only support float16.
+    dtype = torch.float16
     transformers_model_class = AutoModelForCausalLM
+    supports_batching = False
+
+    def __init__(self,
+                 captioning_thread_: 'captioning_thread.CaptioningThread',
+                 caption_settings: dict):
+        super().__init__(captioning_thread_, caption_settings)
+        self.end_of_turn_token_id = None
+        self.text_part_token_ids: dict[str, torch.Tensor] = {}
+
+    @staticmethod
+    def get_model_load_context_manager() -> AbstractContextManager:
+        return suppress_stdout()
 
     def get_additional_error_message(self) -> str | None:
         is_4_bit_model = '4bit' in self.model_id
@@ -46,15 +61,22 @@ class Xcomposer2(AutoCaptioningModel):
                 return 'This model can only be loaded in 4-bit.'
         elif self.load_in_4_bit:
             return 'This model cannot be loaded in 4-bit.'
+        elif self.load_in_8_bit:
+            return 'This model cannot be loaded in 8-bit.'
         return None
 
     def get_processor(self):
         return AutoTokenizer.from_pretrained(self.model_id,
                                              trust_remote_code=True)
 
+    def load_processor_and_model(self):
+        super().load_processor_and_model()
+        self.end_of_turn_token_id = self.processor.convert_tokens_to_ids(
+            '[UNUSED_TOKEN_145]')
+
     def get_model(self):
         if self.load_in_4_bit:
-            with self.model_load_context_manager:
+            with self.get_model_load_context_manager():
                 model = InternLMXComposer2QuantizedForCausalLM.from_quantized(
                     self.model_id, trust_remote_code=True,
                     device=str(self.device))
@@ -75,6 +97,19 @@ class Xcomposer2(AutoCaptioningModel):
     def get_input_text(self, image_prompt: str) -> str:
         return image_prompt + self.caption_start
 
+    def get_text_part_token_ids(self, text_part: str) -> torch.Tensor:
+        # The prompt is usually the same for every image, so the token IDs are
+        # only computed once for each text part.
+        part_token_ids = self.text_part_token_ids.get(text_part)
+        if part_token_ids is None:
+            part_token_ids = self.processor(
+                text_part, return_tensors='pt').input_ids.to(self.device)
+            # Prompts with template variables are different for every image.
+            if len(self.text_part_token_ids) >= 16:
+                self.text_part_token_ids.clear()
+            self.text_part_token_ids[text_part] = part_token_ids
+        return part_token_ids
+
     def get_model_inputs(self, image_prompt: str, image: Image) -> dict:
         text = self.get_input_text(image_prompt)
         pil_image = self.load_image(image)
@@ -84,8 +119,7 @@ class Xcomposer2(AutoCaptioningModel):
             self.device, **self.dtype_argument)
         image_embeddings, *_ = self.model.img2emb(processed_image)
         for text_part in text.split('<ImageHere>'):
-            part_token_ids = self.processor(
-                text_part, return_tensors='pt').input_ids.to(self.device)
+            part_token_ids = self.get_text_part_token_ids(text_part)
             if self.load_in_4_bit:
                 part_embeddings = self.model.model.model.tok_embeddings(
                     part_token_ids)
@@ -100,10 +134,8 @@ class Xcomposer2(AutoCaptioningModel):
         input_embeddings = torch.cat(
             input_embeddings_parts, dim=1).to(self.device)
         image_mask = torch.cat(image_mask_parts, dim=1).bool().to(self.device)
-        eos_token_id = [
-            self.processor.eos_token_id,
-            self.processor.convert_tokens_to_ids(['[UNUSED_TOKEN_145]'])[0]
-        ]
+        eos_token_id = [self.processor.eos_token_id,
+                        self.end_of_turn_token_id]
         model_inputs = {
             'inputs_embeds': input_embeddings,
             'im_mask': image_mask,
@@ -114,9 +146,18 @@ class Xcomposer2(AutoCaptioningModel):
     def get_tokenizer(self):
         return self.processor
 
-    @staticmethod
-    def postprocess_generated_text(generated_text: str) -> str:
-        return generated_text.split('[UNUSED_TOKEN_145]')[0]
+    def get_caption_from_generated_tokens(
+            self, generated_token_ids: torch.Tensor,
+            context_token_count: int = 0) -> str:
+        # Truncate the tokens at the end of turn token instead of splitting
+        # the decoded text.
+        end_of_turn_indices = (generated_token_ids[0]
+                               == self.end_of_turn_token_id).nonzero()
+        if len(end_of_turn_indices):
+            end_of_turn_index = end_of_turn_indices[0, 0].item()
+            generated_token_ids = generated_token_ids[:, :end_of_turn_index]
+        return super().get_caption_from_generated_tokens(generated_token_ids,
+                                                         context_token_count)
 
 
 def pad_image(pil_image: PilImage) -> PilImage:
@@ -13,7 +13,9 @@ from auto_captioning.models.phi_3_vision import Phi3Vision
 from auto_captioning.models.wd_tagger import WdTagger
 from auto_captioning.models.xcomposer2 import Xcomposer2, Xcomposer2_4khd
 
-MODELS = [
+# The order is the order in which the models are listed in the model combo
+# box.
+MODELS = (
     'fancyfeast/llama-joycaption-alpha-two-hf-llava',
     'internlm/internlm-xcomposer2-vl-7b-4bit',
     'internlm/internlm-xcomposer2-vl-7b',
@@ -59,7 +61,7 @@ MODELS = [
     'Salesforce/blip2-flan-t5-xl',
     'Salesforce/blip2-flan-t5-xxl',
     'microsoft/kosmos-2-patch14-224'
-]
+)
 
 
 def get_model_class(model_id: str) -> type[AutoCaptioningModel]:
@@ -5,8 +5,8 @@ from utils.utils import ConfirmationDialog
 class CaptionMultipleImagesDialog(ConfirmationDialog):
     def __init__(self, selected_image_count: int):
         title = 'Generate Captions'
-        question = f'Caption {selected_image_count} selected images?'
-        super().__init__(title=title, question=question)
+        super().__init__(title=title, question='')
+        self.set_selected_image_count(selected_image_count)
         self.show_alert_check_box = SettingsBigCheckBox(
             key='show_alert_when_captioning_finished', default=True,
             text='Show alert when finished')
@@ -14,3 +14,6 @@ class CaptionMultipleImagesDialog(ConfirmationDialog):
         layout = self.layout()
         layout.setContentsMargins(20, 20, 20, 20)
         layout.setSpacing(20)
+
+    def set_selected_image_count(self, selected_image_count: int):
+        self.setText(f'Caption {selected_image_count} selected images?')
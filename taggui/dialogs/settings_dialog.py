@@ -31,6 +31,9 @@ class SettingsDialog(QDialog):
                               5, 0, Qt.AlignmentFlag.AlignRight)
         grid_layout.addWidget(QLabel('Auto-captioning models directory'), 6, 0,
                               Qt.AlignmentFlag.AlignRight)
+        grid_layout.addWidget(
+            QLabel('Auto-captioning image cache size (MiB)'), 8, 0,
+            Qt.AlignmentFlag.AlignRight)
 
         font_size_spin_box = SettingsSpinBox(
             key='font_size', default=DEFAULT_SETTINGS['font_size'],
@@ -75,6 +78,11 @@ class SettingsDialog(QDialog):
         models_directory_button.setFixedWidth(
             int(models_directory_button.sizeHint().width() * 1.3))
         models_directory_button.clicked.connect(self.set_models_directory_path)
+        # A size of 0 disables the cache.
+        self.image_cache_size_spin_box = SettingsSpinBox(
+            key='image_cache_size',
+            default=DEFAULT_SETTINGS['image_cache_size'], minimum=0,
+            maximum=99999)
         file_types_line_edit = SettingsLineEdit(
             key='image_list_file_formats',
             default=DEFAULT_SETTINGS['image_list_file_formats'])
@@ -97,6 +105,8 @@ class SettingsDialog(QDialog):
                               Qt.AlignmentFlag.AlignLeft)
         grid_layout.addWidget(models_directory_button, 7, 1,
                               Qt.AlignmentFlag.AlignLeft)
+        grid_layout.addWidget(self.image_cache_size_spin_box, 8, 1,
+                              Qt.AlignmentFlag.AlignLeft)
         layout.addLayout(grid_layout)
 
         # Prevent the grid layout from moving to the center when the warning
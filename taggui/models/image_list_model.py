@@ -464,6 +464,28 @@ class ImageListModel(QAbstractListModel):
         self.dataChanged.emit(image_index, image_index)
         self.write_image_tags_to_disk(image)
 
+    def update_images_tags(
+            self, image_indices_and_tags: list[tuple[QModelIndex, list[str]]]):
+        """
+        Update the tags of multiple images, emitting `dataChanged` only once
+        for all of them.
+        """
+        changed_image_indices = []
+        for image_index, tags in image_indices_and_tags:
+            image: Image = self.data(image_index, Qt.ItemDataRole.UserRole)
+            if image.tags == tags:
+                continue
+            image.tags = tags
+            self.write_image_tags_to_disk(image)
+            changed_image_indices.append(image_index)
+        if not changed_image_indices:
+            return
+        min_image_index = min(changed_image_indices,
+                              key=lambda index: index.row())
+        max_image_index = max(changed_image_indices,
+                              key=lambda index: index.row())
+        self.dataChanged.emit(min_image_index, max_image_index)
+
     @Slot(list, list)
     def add_tags(self, tags: list[str], image_indices: list[QModelIndex]):
         """Add one or more tags to one or more images."""
@@ -24,3 +24,9 @@ class CaptionPosition(str, Enum):
 class CaptionDevice(str, Enum):
     GPU = 'GPU if available'
     CPU = 'CPU'
+
+
+class CaptionQuantization(str, Enum):
+    NONE = 'None'
+    EIGHT_BIT = '8-bit'
+    FOUR_BIT = '4-bit'
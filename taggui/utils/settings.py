@@ -9,7 +9,10 @@ DEFAULT_SETTINGS = {
     'tag_separator': ',',
     'insert_space_after_tag_separator': True,
     'autocomplete_tags': True,
-    'models_directory_path': ''
+    'models_directory_path': '',
+    # The maximum total size in MiB of the decoded images that are kept
+    # between auto-captioning runs.
+    'image_cache_size': 256
 }
 
 
@@ -1,11 +1,63 @@
-from PySide6.QtCore import Qt
+from collections.abc import Callable
+
+from PySide6.QtCore import QCoreApplication, QSignalBlocker, Qt, QTimer
 from PySide6.QtWidgets import (QComboBox, QDoubleSpinBox, QLineEdit,
-                               QPlainTextEdit, QSpinBox)
+                               QPlainTextEdit, QSpinBox, QWidget)
 
 from utils.big_widgets import BigCheckBox
 from utils.focused_scroll_mixin import FocusedScrollMixin
 from utils.settings import get_settings
 
+# How long to wait after the last change of a setting that can change rapidly
+# (by typing or by scrolling) before saving it.
+SETTING_SAVE_DELAY = 250
+
+# The save functions of settings that have changed but have not been saved yet.
+# They are all saved by a single slot when the app is about to quit.
+pending_setting_savers: set[Callable[[], None]] = set()
+is_save_pending_settings_connected = False
+
+
+def save_pending_settings():
+    for save in list(pending_setting_savers):
+        save()
+
+
+def get_delayed_setting_saver(widget: QWidget,
+                              key: str) -> Callable[[object], None]:
+    """
+    Return a function that saves a setting once the user has stopped changing
+    it, instead of writing the setting on every keystroke or scroll step.
+    """
+    settings = get_settings()
+    global is_save_pending_settings_connected
+    if not is_save_pending_settings_connected:
+        QCoreApplication.instance().aboutToQuit.connect(save_pending_settings)
+        is_save_pending_settings_connected = True
+    pending_value = None
+    timer = QTimer(widget)
+    timer.setSingleShot(True)
+    timer.setInterval(SETTING_SAVE_DELAY)
+
+    def save():
+        nonlocal pending_value
+        if pending_value is not None:
+            settings.setValue(key, pending_value)
+            pending_value = None
+        pending_setting_savers.discard(save)
+
+    def save_later(value):
+        nonlocal pending_value
+        pending_value = value
+        pending_setting_savers.add(save)
+        timer.start()
+
+    timer.timeout.connect(save)
+    # Do not lose the last edit if the widget or the app is closed before the
+    # timer fires.
+    widget.destroyed.connect(save)
+    return save_later
+
 
 class SettingsBigCheckBox(BigCheckBox):
     def __init__(self, key: str, default: bool, text: str | None = None):
@@ -23,14 +75,29 @@ class SettingsComboBox(QComboBox):
         self.key = key
         self.default = default
         self.settings = get_settings()
+        # The last value that was read from or written to the setting.
+        self.setting: str | None = None
+        self.currentTextChanged.connect(self.save_setting)
+
+    def save_setting(self, text: str):
+        # Editing the text of an editable combo box and then changing it back
+        # should not write the setting again.
+        if text == self.setting:
+            return
+        self.settings.setValue(self.key, text)
+        self.setting = text
 
     def addItems(self, texts: list[str]):
         setting: str = self.settings.value(self.key, self.default, type=str)
+        self.setting = setting
+        # Block the signals so that adding the items and restoring the setting
+        # do not save the setting again. This also means that the setting is
+        # not overwritten by the first item that is added.
+        signal_blocker = QSignalBlocker(self)
         super().addItems(texts)
-        self.currentTextChanged.connect(
-            lambda text: self.settings.setValue(self.key, text))
         if setting:
             self.setCurrentText(setting)
+        signal_blocker.unblock()
 
 
 class FocusedScrollSettingsComboBox(FocusedScrollMixin, SettingsComboBox):
@@ -46,7 +113,7 @@ class FocusedScrollSettingsDoubleSpinBox(FocusedScrollMixin, QDoubleSpinBox):
         self.setRange(minimum, maximum)
         settings = get_settings()
         self.setValue(settings.value(key, default, type=float))
-        self.valueChanged.connect(lambda value: settings.setValue(key, value))
+        self.valueChanged.connect(get_delayed_setting_saver(self, key))
 
 
 class SettingsSpinBox(QSpinBox):
@@ -55,7 +122,7 @@ class SettingsSpinBox(QSpinBox):
         self.setRange(minimum, maximum)
         settings = get_settings()
         self.setValue(settings.value(key, default, type=int))
-        self.valueChanged.connect(lambda value: settings.setValue(key, value))
+        self.valueChanged.connect(get_delayed_setting_saver(self, key))
 
 
 class FocusedScrollSettingsSpinBox(FocusedScrollMixin, SettingsSpinBox):
@@ -67,7 +134,7 @@ class SettingsLineEdit(QLineEdit):
         super().__init__()
         settings = get_settings()
         self.setText(settings.value(key, default, type=str))
-        self.textChanged.connect(lambda text: settings.setValue(key, text))
+        self.textChanged.connect(get_delayed_setting_saver(self, key))
 
 
 class SettingsPlainTextEdit(QPlainTextEdit):
@@ -75,5 +142,5 @@ class SettingsPlainTextEdit(QPlainTextEdit):
         super().__init__()
         settings = get_settings()
         self.setPlainText(settings.value(key, default, type=str))
-        self.textChanged.connect(lambda: settings.setValue(key,
-                                                           self.toPlainText()))
+        save_later = get_delayed_setting_saver(self, key)
+        self.textChanged.connect(lambda: save_later(self.toPlainText()))
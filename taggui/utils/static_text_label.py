@@ -0,0 +1,28 @@
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QPainter, QPaintEvent, QStaticText, QTransform
+from PySide6.QtWidgets import QLabel, QStyle
+
+
+class StaticTextLabel(QLabel):
+    """
+    A label for fixed plain text that keeps the layout of its text between
+    paints instead of laying it out again every time it is painted.
+    """
+
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.static_text = QStaticText(text)
+        self.static_text.setTextFormat(Qt.TextFormat.PlainText)
+        self.static_text_font = None
+
+    def paintEvent(self, event: QPaintEvent):
+        font = self.font()
+        if font != self.static_text_font:
+            self.static_text.prepare(QTransform(), font)
+            self.static_text_font = font
+        text_rect = QStyle.alignedRect(
+            self.layoutDirection(), self.alignment(),
+            self.static_text.size().toSize(), self.contentsRect())
+        painter = QPainter(self)
+        painter.setPen(self.palette().color(self.foregroundRole()))
+        painter.drawStaticText(text_rect.topLeft(), self.static_text)
@@ -1,29 +1,62 @@
+import hashlib
+import importlib.util
+import logging
+import os
 import sys
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-from PySide6.QtCore import QModelIndex, Qt, Signal, Slot
-from PySide6.QtGui import QFontMetrics, QTextCursor
-from PySide6.QtWidgets import (QAbstractScrollArea, QDockWidget, QFormLayout,
-                               QFrame, QHBoxLayout, QLabel, QMessageBox,
+import torch
+from PySide6.QtCore import (QSettings, QSignalBlocker, Qt, QThreadPool, QTimer,
+                            Signal, Slot)
+from PySide6.QtGui import QFont, QFontMetrics, QShowEvent, QTextCursor
+from PySide6.QtWidgets import (QDockWidget, QFormLayout, QFrame, QMessageBox,
                                QPlainTextEdit, QProgressBar, QScrollArea,
                                QVBoxLayout, QWidget)
 
 from auto_captioning.captioning_thread import CaptioningThread
+from auto_captioning.image_cache import ImageCache
 from auto_captioning.models.wd_tagger import WdTagger
 from auto_captioning.models_list import MODELS, get_model_class
 from dialogs.caption_multiple_images_dialog import CaptionMultipleImagesDialog
 from models.image_list_model import ImageListModel
 from utils.big_widgets import TallPushButton
-from utils.enums import CaptionDevice, CaptionPosition
+from utils.enums import CaptionDevice, CaptionPosition, CaptionQuantization
 from utils.settings import DEFAULT_SETTINGS, get_settings, get_tag_separator
 from utils.settings_widgets import (FocusedScrollSettingsComboBox,
                                     FocusedScrollSettingsDoubleSpinBox,
                                     FocusedScrollSettingsSpinBox,
                                     SettingsBigCheckBox, SettingsLineEdit,
                                     SettingsPlainTextEdit)
+from utils.static_text_label import StaticTextLabel
 from utils.utils import pluralize
 from widgets.image_list import ImageList
 
+# The interval in milliseconds at which outputted text is added to the
+# console text edit.
+CONSOLE_FLUSH_INTERVAL = 50
+# The maximum number of blocks (lines) kept in the console text edit. The
+# oldest blocks are removed when the limit is reached.
+CONSOLE_MAX_BLOCK_COUNT = 10000
+# The delay in milliseconds after the model ID is typed before the settings for
+# the model are shown.
+MODEL_ID_EDIT_DELAY = 150
+
+
+# The line spacings of the fonts that have been measured, keyed by
+# `QFont.key()`.
+line_spacing_cache: dict[str, int] = {}
+
+
+def get_line_spacing(font: QFont) -> int:
+    font_key = font.key()
+    line_spacing = line_spacing_cache.get(font_key)
+    if line_spacing is None:
+        line_spacing = QFontMetrics(font).lineSpacing()
+        line_spacing_cache[font_key] = line_spacing
+    return line_spacing
+
 
 def set_text_edit_height(text_edit: QPlainTextEdit, line_count: int):
     """
@@ -31,15 +64,191 @@ def set_text_edit_height(text_edit: QPlainTextEdit, line_count: int):
     """
     # From https://stackoverflow.com/a/46997337.
     document = text_edit.document()
-    font_metrics = QFontMetrics(document.defaultFont())
     margins = text_edit.contentsMargins()
-    height = int(font_metrics.lineSpacing() * line_count
+    height = int(get_line_spacing(document.defaultFont()) * line_count
                  + margins.top() + margins.bottom()
                  + document.documentMargin() * 2
                  + text_edit.frameWidth() * 2)
     text_edit.setFixedHeight(height)
 
 
+def migrate_load_in_4_bit_setting(settings: QSettings):
+    """Convert the old `load_in_4_bit` setting to `quantization`."""
+    if (settings.contains('quantization')
+            or not settings.contains('load_in_4_bit')):
+        return
+    load_in_4_bit = settings.value('load_in_4_bit', type=bool)
+    quantization = (CaptionQuantization.FOUR_BIT if load_in_4_bit
+                    else CaptionQuantization.NONE)
+    settings.setValue('quantization', quantization.value)
+    settings.remove('load_in_4_bit')
+
+
+# Auto-captioning models have a `config.json` file, and WD Tagger models have a
+# `selected_tags.csv` file.
+MODEL_FILE_NAMES = {'config.json', 'selected_tags.csv'}
+
+
+# The number of threads used to scan the models directory. Scanning is bound
+# by disk or network latency rather than by the CPU, so more threads than CPU
+# cores can be used.
+MODEL_DIRECTORY_SCAN_THREAD_COUNT = min(8, (os.cpu_count() or 1) * 2)
+
+
+def scan_directory(directory_path: str
+                   ) -> tuple[bool, list[tuple[str, str | None]]]:
+    """
+    Scan a directory for model files and subdirectories to search. Return
+    whether the directory contains a model file, and the paths of the
+    non-hidden subdirectories along with their target paths if they are
+    symlinks.
+    """
+    has_model_file = False
+    subdirectory_paths = []
+    try:
+        entries = os.scandir(directory_path)
+    except OSError:
+        return has_model_file, subdirectory_paths
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if entry.name.startswith('.'):
+                        continue
+                    target_path = (os.path.realpath(entry.path)
+                                   if entry.is_symlink() else None)
+                    subdirectory_paths.append((entry.path, target_path))
+                elif entry.name in MODEL_FILE_NAMES:
+                    has_model_file = True
+            except OSError:
+                continue
+    return has_model_file, subdirectory_paths
+
+
+def iterate_model_directory_paths(root_path: str) -> Iterator[str]:
+    """
+    Yield the paths of all directories under `root_path` (including itself)
+    that contain a model. `os.scandir()` is used because its entries cache
+    their file types, so no extra `stat()` call is needed per entry. The
+    directories are scanned in parallel because each scan mostly waits on
+    the disk, which matters for large or network-mounted directories. The
+    subdirectories of model directories and hidden directories are not
+    searched because they do not contain other models.
+    """
+    # Symlinked directories are followed, but only once each so that symlink
+    # cycles do not cause an infinite loop.
+    visited_symlink_target_paths = set()
+    with ThreadPoolExecutor(
+            max_workers=MODEL_DIRECTORY_SCAN_THREAD_COUNT) as executor:
+        directory_paths = {executor.submit(scan_directory, root_path):
+                           root_path}
+        while directory_paths:
+            done_futures, _ = wait(directory_paths,
+                                   return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                directory_path = directory_paths.pop(future)
+                has_model_file, subdirectory_paths = future.result()
+                if has_model_file:
+                    yield directory_path
+                    continue
+                for subdirectory_path, target_path in subdirectory_paths:
+                    if target_path is not None:
+                        if target_path in visited_symlink_target_paths:
+                            continue
+                        visited_symlink_target_paths.add(target_path)
+                    directory_paths[executor.submit(
+                        scan_directory, subdirectory_path)] = subdirectory_path
+
+
+def get_models_directory_signature(root_path: str) -> str | None:
+    """
+    Get a value that changes when models are added to or removed from the
+    models directory, without walking the whole directory tree. The
+    modification times of the directory and of its subdirectories are used,
+    so models nested deeper than that are only detected when one of these
+    directories changes.
+    """
+    try:
+        modification_times = [('', os.stat(root_path).st_mtime_ns)]
+        with os.scandir(root_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    modification_times.append(
+                        (entry.name, entry.stat().st_mtime_ns))
+    except OSError:
+        return None
+    modification_times.sort()
+    signature_data = repr((root_path, modification_times)).encode()
+    return hashlib.sha256(signature_data).hexdigest()
+
+
+def iterate_local_model_paths() -> Iterator[list[str]]:
+    """
+    Yield the paths of the models in the models directory. The cached paths
+    are yielded first so that they can be shown right away, and the paths
+    found by scanning the models directory are yielded afterwards if the
+    directory has changed since they were cached. This is run in a background
+    thread, so it uses its own `QSettings` object.
+    """
+    settings = get_settings()
+    models_directory_path = settings.value(
+        'models_directory_path',
+        defaultValue=DEFAULT_SETTINGS['models_directory_path'], type=str)
+    if not models_directory_path:
+        return
+    models_directory_path = str(Path(models_directory_path))
+    cached_model_directory_paths = settings.value(
+        'local_model_paths_cache', defaultValue=[], type=list)
+    if cached_model_directory_paths:
+        yield cached_model_directory_paths
+    signature = get_models_directory_signature(models_directory_path)
+    if (signature is not None and signature == settings.value(
+            'local_model_paths_cache_signature', type=str)):
+        return
+    logging.debug(f'Loading local auto-captioning model paths under '
+                  f'{models_directory_path}...')
+    model_directory_paths = sorted(
+        iterate_model_directory_paths(models_directory_path))
+    logging.debug(f'Loaded {len(model_directory_paths)} model '
+                  f'{pluralize("path", len(model_directory_paths))}.')
+    if signature is not None:
+        settings.setValue('local_model_paths_cache', model_directory_paths)
+        settings.setValue('local_model_paths_cache_signature', signature)
+    if model_directory_paths != cached_model_directory_paths:
+        yield model_directory_paths
+
+
+# The advanced settings are read from the settings when the advanced settings
+# form has not been built yet.
+ADVANCED_SETTINGS_DEFAULTS = {
+    'bad_words': '',
+    'forced_words': '',
+    'min_new_tokens': 1,
+    'max_new_tokens': 100,
+    'num_beams': 1,
+    'length_penalty': 1.0,
+    'do_sample': False,
+    'temperature': 1.0,
+    'top_k': 50,
+    'top_p': 1.0,
+    'repetition_penalty': 1.0,
+    'no_repeat_ngram_size': 3,
+    'batch_size': 1,
+    'compile_model': False,
+    'gpu_index': 0
+}
+
+# The WD Tagger settings are read from the settings when the WD Tagger settings
+# form has not been built yet. The keys of the settings are prefixed with
+# `wd_tagger_`.
+WD_TAGGER_SETTINGS_DEFAULTS = {
+    'show_probabilities': True,
+    'min_probability': 0.4,
+    'max_tags': 30,
+    'tags_to_exclude': ''
+}
+
+
 class HorizontalLine(QFrame):
     def __init__(self):
         super().__init__()
@@ -48,14 +257,13 @@ class HorizontalLine(QFrame):
 
 
 class CaptionSettingsForm(QVBoxLayout):
-    def __init__(self):
+    local_model_paths_loaded = Signal(list)
+
+    def __init__(self, is_bitsandbytes_available: bool | None):
         super().__init__()
         self.settings = get_settings()
-        try:
-            import bitsandbytes
-            self.is_bitsandbytes_available = True
-        except RuntimeError:
-            self.is_bitsandbytes_available = False
+        # `None` if it has not been checked yet.
+        self.is_bitsandbytes_available = is_bitsandbytes_available
         basic_settings_form = QFormLayout()
         basic_settings_form.setRowWrapPolicy(
             QFormLayout.RowWrapPolicy.WrapAllRows)
@@ -65,7 +273,6 @@ class CaptionSettingsForm(QVBoxLayout):
         # `setEditable()` must be called before `addItems()` to preserve any
         # custom model that was set.
         self.model_combo_box.setEditable(True)
-        self.model_combo_box.addItems(self.get_local_model_paths())
         self.model_combo_box.addItems(MODELS)
         self.prompt_text_edit = SettingsPlainTextEdit(key='prompt')
         set_text_edit_height(self.prompt_text_edit, 4)
@@ -76,75 +283,202 @@ class CaptionSettingsForm(QVBoxLayout):
         self.caption_position_combo_box.addItems(list(CaptionPosition))
         self.device_combo_box = FocusedScrollSettingsComboBox(key='device')
         self.device_combo_box.addItems(list(CaptionDevice))
-        self.load_in_4_bit_container = QWidget()
-        load_in_4_bit_layout = QHBoxLayout()
-        load_in_4_bit_layout.setAlignment(Qt.AlignmentFlag.AlignLeft)
-        load_in_4_bit_layout.setContentsMargins(0, 0, 0, 0)
-        self.load_in_4_bit_check_box = SettingsBigCheckBox(
-            key='load_in_4_bit', default=True)
-        load_in_4_bit_layout.addWidget(QLabel('Load in 4-bit'))
-        load_in_4_bit_layout.addWidget(self.load_in_4_bit_check_box)
-        self.load_in_4_bit_container.setLayout(load_in_4_bit_layout)
-        self.remove_tag_separators_container = QWidget()
-        remove_tag_separators_layout = QHBoxLayout(
-            self.remove_tag_separators_container)
-        remove_tag_separators_layout.setAlignment(Qt.AlignmentFlag.AlignLeft)
-        remove_tag_separators_layout.setContentsMargins(0, 0, 0, 0)
+        migrate_load_in_4_bit_setting(self.settings)
+        self.quantization_combo_box = FocusedScrollSettingsComboBox(
+            key='quantization', default=CaptionQuantization.FOUR_BIT.value)
+        self.quantization_combo_box.addItems(list(CaptionQuantization))
+        # Use the text of the check box instead of a separate label so that no
+        # container widget and layout are needed.
         self.remove_tag_separators_check_box = SettingsBigCheckBox(
-            key='remove_tag_separators', default=True)
-        remove_tag_separators_label = QLabel(
-            'Remove tag separators in caption')
-        remove_tag_separators_layout.addWidget(remove_tag_separators_label)
-        remove_tag_separators_layout.addWidget(
-            self.remove_tag_separators_check_box)
-        basic_settings_form.addRow('Model', self.model_combo_box)
-        self.prompt_label = QLabel('Prompt')
+            key='remove_tag_separators', default=True,
+            text='Remove tag separators in caption')
+        basic_settings_form.addRow(StaticTextLabel('Model'),
+                                   self.model_combo_box)
+        self.prompt_label = StaticTextLabel('Prompt')
         basic_settings_form.addRow(self.prompt_label, self.prompt_text_edit)
-        self.caption_start_label = QLabel('Start caption with')
+        self.caption_start_label = StaticTextLabel('Start caption with')
         basic_settings_form.addRow(self.caption_start_label,
                                    self.caption_start_line_edit)
-        basic_settings_form.addRow('Caption position',
+        basic_settings_form.addRow(StaticTextLabel('Caption position'),
                                    self.caption_position_combo_box)
-        self.device_label = QLabel('Device')
+        self.device_label = StaticTextLabel('Device')
         basic_settings_form.addRow(self.device_label, self.device_combo_box)
-        basic_settings_form.addRow(self.load_in_4_bit_container)
-        basic_settings_form.addRow(self.remove_tag_separators_container)
+        self.quantization_label = StaticTextLabel('Quantization')
+        basic_settings_form.addRow(self.quantization_label,
+                                   self.quantization_combo_box)
+        basic_settings_form.addRow(self.remove_tag_separators_check_box)
 
+        # The WD Tagger settings form is only built when a WD Tagger model is
+        # first selected.
         self.wd_tagger_settings_form_container = QWidget()
+        self.is_wd_tagger_settings_form_built = False
+        self.wd_tagger_settings_form_container.hide()
+
+        self.toggle_advanced_settings_form_button = TallPushButton(
+            'Show Advanced Settings')
+
+        # The advanced settings form is only built when it is first shown.
+        self.advanced_settings_form_container = QWidget()
+        self.is_advanced_settings_form_built = False
+        self.is_advanced_settings_form_shown = False
+        self.advanced_settings_form_container.hide()
+
+        self.addLayout(basic_settings_form)
+        self.addWidget(self.wd_tagger_settings_form_container)
+        self.horizontal_line = HorizontalLine()
+        self.addWidget(self.horizontal_line)
+        self.addWidget(self.toggle_advanced_settings_form_button)
+        self.addWidget(self.advanced_settings_form_container)
+        self.addStretch()
+
+        # Showing the settings for a model changes the visibility of many
+        # widgets, so it is delayed while the model ID is being typed. Models
+        # selected from the list are shown immediately.
+        self.model_id_edit_timer = QTimer(self)
+        self.model_id_edit_timer.setSingleShot(True)
+        self.model_id_edit_timer.setInterval(MODEL_ID_EDIT_DELAY)
+        self.model_id_edit_timer.timeout.connect(
+            self.show_settings_for_current_model)
+        self.model_combo_box.currentTextChanged.connect(
+            lambda: self.model_id_edit_timer.start())
+        self.model_combo_box.currentIndexChanged.connect(
+            self.show_settings_for_current_model)
+        self.device_combo_box.currentTextChanged.connect(
+            self.set_quantization_visibility)
+        self.toggle_advanced_settings_form_button.clicked.connect(
+            self.toggle_advanced_settings_form)
+
+        # The model that the shown settings are for.
+        self.model_id: str | None = None
+        self.is_wd_tagger_model = False
+
+        # Scanning the models directory can take a while, so the local models
+        # are loaded in the background. The cached local models are added to
+        # the model combo box first and are replaced when the scan has
+        # finished.
+        self.local_model_path_count = 0
+        self.local_model_paths_loaded.connect(self.set_local_model_paths)
+        QThreadPool.globalInstance().start(self.load_local_model_paths)
+
+        if self.is_bitsandbytes_available is False:
+            self.quantization_combo_box.setCurrentText(
+                CaptionQuantization.NONE)
+        # This also sets the initial visibility of the quantization setting.
+        self.show_settings_for_model(self.model_combo_box.currentText())
+
+    def set_is_bitsandbytes_available(self, is_bitsandbytes_available: bool):
+        self.is_bitsandbytes_available = is_bitsandbytes_available
+        self.set_quantization_visibility(self.device_combo_box.currentText())
+        if not is_bitsandbytes_available:
+            self.quantization_combo_box.setCurrentText(
+                CaptionQuantization.NONE)
+
+    def load_local_model_paths(self):
+        for local_model_paths in iterate_local_model_paths():
+            self.local_model_paths_loaded.emit(local_model_paths)
+
+    @Slot(list)
+    def set_local_model_paths(self, local_model_paths: list[str]):
+        # Keep the selected model, which may be a custom one that is not in
+        # the list.
+        model_id = self.model_combo_box.currentText()
+        signal_blocker = QSignalBlocker(self.model_combo_box)
+        self.model_combo_box.model().removeRows(0,
+                                                self.local_model_path_count)
+        self.model_combo_box.insertItems(0, local_model_paths)
+        self.local_model_path_count = len(local_model_paths)
+        self.model_combo_box.setCurrentText(model_id)
+        signal_blocker.unblock()
+
+    @Slot()
+    def show_settings_for_current_model(self):
+        self.model_id_edit_timer.stop()
+        self.show_settings_for_model(self.model_combo_box.currentText())
+
+    def show_settings_for_model(self, model_id: str):
+        if model_id == self.model_id:
+            return
+        is_first_model = self.model_id is None
+        self.model_id = model_id
+        is_wd_tagger_model = get_model_class(model_id) == WdTagger
+        # The visibility of the settings only depends on whether the model is
+        # a WD Tagger model.
+        if (not is_first_model
+                and is_wd_tagger_model == self.is_wd_tagger_model):
+            return
+        self.is_wd_tagger_model = is_wd_tagger_model
+        wd_tagger_widgets = [self.wd_tagger_settings_form_container]
+        non_wd_tagger_widgets = [
+            self.prompt_label,
+            self.prompt_text_edit,
+            self.caption_start_label,
+            self.caption_start_line_edit,
+            self.device_label,
+            self.device_combo_box,
+            self.quantization_label,
+            self.quantization_combo_box,
+            self.remove_tag_separators_check_box,
+            self.horizontal_line,
+            self.toggle_advanced_settings_form_button
+        ]
+        if is_wd_tagger_model and not self.is_wd_tagger_settings_form_built:
+            self.build_wd_tagger_settings_form()
+        for widget in wd_tagger_widgets:
+            widget.setVisible(is_wd_tagger_model)
+        for widget in non_wd_tagger_widgets:
+            widget.setVisible(not is_wd_tagger_model)
+        self.advanced_settings_form_container.setVisible(
+            not is_wd_tagger_model and self.is_advanced_settings_form_shown)
+        self.set_quantization_visibility(self.device_combo_box.currentText())
+
+    @Slot(str)
+    def set_quantization_visibility(self, device: str):
+        is_quantization_available = (not self.is_wd_tagger_model
+                                     and bool(self.is_bitsandbytes_available)
+                                     and device == CaptionDevice.GPU)
+        self.quantization_label.setVisible(is_quantization_available)
+        self.quantization_combo_box.setVisible(is_quantization_available)
+
+    def build_wd_tagger_settings_form(self):
+        defaults = WD_TAGGER_SETTINGS_DEFAULTS
         wd_tagger_settings_form = QFormLayout(
             self.wd_tagger_settings_form_container)
         wd_tagger_settings_form.setLabelAlignment(Qt.AlignmentFlag.AlignRight)
         wd_tagger_settings_form.setFieldGrowthPolicy(
             QFormLayout.FieldGrowthPolicy.ExpandingFieldsGrow)
         self.show_probabilities_check_box = SettingsBigCheckBox(
-            key='wd_tagger_show_probabilities', default=True)
+            key='wd_tagger_show_probabilities',
+            default=defaults['show_probabilities'])
         self.min_probability_spin_box = FocusedScrollSettingsDoubleSpinBox(
-            key='wd_tagger_min_probability', default=0.4, minimum=0.01,
-            maximum=1)
+            key='wd_tagger_min_probability',
+            default=defaults['min_probability'], minimum=0.01, maximum=1)
         self.min_probability_spin_box.setSingleStep(0.01)
         self.max_tags_spin_box = FocusedScrollSettingsSpinBox(
-            key='wd_tagger_max_tags', default=30, minimum=1, maximum=999)
+            key='wd_tagger_max_tags', default=defaults['max_tags'],
+            minimum=1, maximum=999)
         tags_to_exclude_form = QFormLayout()
         tags_to_exclude_form.setRowWrapPolicy(
             QFormLayout.RowWrapPolicy.WrapAllRows)
         tags_to_exclude_form.setFieldGrowthPolicy(
             QFormLayout.FieldGrowthPolicy.ExpandingFieldsGrow)
         self.tags_to_exclude_text_edit = SettingsPlainTextEdit(
-            key='wd_tagger_tags_to_exclude')
-        tags_to_exclude_form.addRow('Tags to exclude',
+            key='wd_tagger_tags_to_exclude',
+            default=defaults['tags_to_exclude'])
+        tags_to_exclude_form.addRow(StaticTextLabel('Tags to exclude'),
                                     self.tags_to_exclude_text_edit)
         set_text_edit_height(self.tags_to_exclude_text_edit, 4)
-        wd_tagger_settings_form.addRow('Show probabilities',
-                                       self.show_probabilities_check_box)
-        wd_tagger_settings_form.addRow('Minimum probability',
-                                       self.min_probability_spin_box)
-        wd_tagger_settings_form.addRow('Maximum tags', self.max_tags_spin_box)
+        wd_tagger_rows = (
+            ('Show probabilities', self.show_probabilities_check_box),
+            ('Minimum probability', self.min_probability_spin_box),
+            ('Maximum tags', self.max_tags_spin_box)
+        )
+        for label_text, widget in wd_tagger_rows:
+            wd_tagger_settings_form.addRow(StaticTextLabel(label_text), widget)
         wd_tagger_settings_form.addRow(tags_to_exclude_form)
+        self.is_wd_tagger_settings_form_built = True
 
-        self.toggle_advanced_settings_form_button = TallPushButton(
-            'Show Advanced Settings')
-
-        self.advanced_settings_form_container = QWidget()
+    def build_advanced_settings_form(self):
+        defaults = ADVANCED_SETTINGS_DEFAULTS
         advanced_settings_form = QFormLayout(
             self.advanced_settings_form_container)
         advanced_settings_form.setLabelAlignment(Qt.AlignmentFlag.AlignRight)
@@ -155,202 +489,181 @@ class CaptionSettingsForm(QVBoxLayout):
             QFormLayout.RowWrapPolicy.WrapAllRows)
         bad_forced_words_form.setFieldGrowthPolicy(
             QFormLayout.FieldGrowthPolicy.ExpandingFieldsGrow)
-        self.bad_words_line_edit = SettingsLineEdit(key='bad_words')
+        self.bad_words_line_edit = SettingsLineEdit(
+            key='bad_words', default=defaults['bad_words'])
         self.bad_words_line_edit.setClearButtonEnabled(True)
-        self.forced_words_line_edit = SettingsLineEdit(key='forced_words')
+        self.forced_words_line_edit = SettingsLineEdit(
+            key='forced_words', default=defaults['forced_words'])
         self.forced_words_line_edit.setClearButtonEnabled(True)
-        bad_forced_words_form.addRow('Discourage from caption',
-                                     self.bad_words_line_edit)
-        bad_forced_words_form.addRow('Include in caption',
+        bad_forced_words_form.addRow(
+            StaticTextLabel('Discourage from caption'),
+            self.bad_words_line_edit)
+        bad_forced_words_form.addRow(StaticTextLabel('Include in caption'),
                                      self.forced_words_line_edit)
         self.min_new_token_count_spin_box = FocusedScrollSettingsSpinBox(
-            key='min_new_tokens', default=1, minimum=1, maximum=999)
+            key='min_new_tokens', default=defaults['min_new_tokens'],
+            minimum=1, maximum=999)
         self.max_new_token_count_spin_box = FocusedScrollSettingsSpinBox(
-            key='max_new_tokens', default=100, minimum=1, maximum=999)
+            key='max_new_tokens', default=defaults['max_new_tokens'],
+            minimum=1, maximum=999)
         self.beam_count_spin_box = FocusedScrollSettingsSpinBox(
-            key='num_beams', default=1, minimum=1, maximum=99)
+            key='num_beams', default=defaults['num_beams'], minimum=1,
+            maximum=99)
         self.length_penalty_spin_box = FocusedScrollSettingsDoubleSpinBox(
-            key='length_penalty', default=1, minimum=-5, maximum=5)
+            key='length_penalty', default=defaults['length_penalty'],
+            minimum=-5, maximum=5)
         self.length_penalty_spin_box.setSingleStep(0.1)
-        self.use_sampling_check_box = SettingsBigCheckBox(key='do_sample',
-                                                          default=False)
+        self.use_sampling_check_box = SettingsBigCheckBox(
+            key='do_sample', default=defaults['do_sample'])
         # The temperature must be positive.
         self.temperature_spin_box = FocusedScrollSettingsDoubleSpinBox(
-            key='temperature', default=1, minimum=0.01, maximum=2)
+            key='temperature', default=defaults['temperature'], minimum=0.01,
+            maximum=2)
         self.temperature_spin_box.setSingleStep(0.01)
         self.top_k_spin_box = FocusedScrollSettingsSpinBox(
-            key='top_k', default=50, minimum=0, maximum=200)
+            key='top_k', default=defaults['top_k'], minimum=0, maximum=200)
         self.top_p_spin_box = FocusedScrollSettingsDoubleSpinBox(
-            key='top_p', default=1, minimum=0, maximum=1)
+            key='top_p', default=defaults['top_p'], minimum=0, maximum=1)
         self.top_p_spin_box.setSingleStep(0.01)
         self.repetition_penalty_spin_box = FocusedScrollSettingsDoubleSpinBox(
-            key='repetition_penalty', default=1, minimum=1, maximum=2)
+            key='repetition_penalty', default=defaults['repetition_penalty'],
+            minimum=1, maximum=2)
         self.repetition_penalty_spin_box.setSingleStep(0.01)
         self.no_repeat_ngram_size_spin_box = FocusedScrollSettingsSpinBox(
-            key='no_repeat_ngram_size', default=3, minimum=0, maximum=5)
+            key='no_repeat_ngram_size',
+            default=defaults['no_repeat_ngram_size'], minimum=0, maximum=5)
+        self.batch_size_spin_box = FocusedScrollSettingsSpinBox(
+            key='batch_size', default=defaults['batch_size'], minimum=1,
+            maximum=64)
+        self.compile_model_check_box = SettingsBigCheckBox(
+            key='compile_model', default=defaults['compile_model'])
+        if importlib.util.find_spec('triton') is None:
+            self.compile_model_check_box.setEnabled(False)
+            self.compile_model_check_box.setToolTip(
+                'Compiling the model requires Triton, which is not installed.')
         self.gpu_index_spin_box = FocusedScrollSettingsSpinBox(
-            key='gpu_index', default=0, minimum=0, maximum=9)
+            key='gpu_index', default=defaults['gpu_index'], minimum=0,
+            maximum=9)
         advanced_settings_form.addRow(bad_forced_words_form)
         advanced_settings_form.addRow(HorizontalLine())
-        advanced_settings_form.addRow('Minimum tokens',
-                                      self.min_new_token_count_spin_box)
-        advanced_settings_form.addRow('Maximum tokens',
-                                      self.max_new_token_count_spin_box)
-        advanced_settings_form.addRow('Number of beams',
-                                      self.beam_count_spin_box)
-        advanced_settings_form.addRow('Length penalty',
-                                      self.length_penalty_spin_box)
-        advanced_settings_form.addRow('Use sampling',
-                                      self.use_sampling_check_box)
-        advanced_settings_form.addRow('Temperature',
-                                      self.temperature_spin_box)
-        advanced_settings_form.addRow('Top-k', self.top_k_spin_box)
-        advanced_settings_form.addRow('Top-p', self.top_p_spin_box)
-        advanced_settings_form.addRow('Repetition penalty',
-                                      self.repetition_penalty_spin_box)
-        advanced_settings_form.addRow('No repeat n-gram size',
-                                      self.no_repeat_ngram_size_spin_box)
+        generation_rows = (
+            ('Minimum tokens', self.min_new_token_count_spin_box),
+            ('Maximum tokens', self.max_new_token_count_spin_box),
+            ('Number of beams', self.beam_count_spin_box),
+            ('Length penalty', self.length_penalty_spin_box),
+            ('Use sampling', self.use_sampling_check_box),
+            ('Temperature', self.temperature_spin_box),
+            ('Top-k', self.top_k_spin_box),
+            ('Top-p', self.top_p_spin_box),
+            ('Repetition penalty', self.repetition_penalty_spin_box),
+            ('No repeat n-gram size', self.no_repeat_ngram_size_spin_box)
+        )
+        for label_text, widget in generation_rows:
+            advanced_settings_form.addRow(StaticTextLabel(label_text), widget)
         advanced_settings_form.addRow(HorizontalLine())
-        advanced_settings_form.addRow('GPU index', self.gpu_index_spin_box)
-        self.advanced_settings_form_container.hide()
-
-        self.addLayout(basic_settings_form)
-        self.addWidget(self.wd_tagger_settings_form_container)
-        self.horizontal_line = HorizontalLine()
-        self.addWidget(self.horizontal_line)
-        self.addWidget(self.toggle_advanced_settings_form_button)
-        self.addWidget(self.advanced_settings_form_container)
-        self.addStretch()
-
-        self.model_combo_box.currentTextChanged.connect(
-            self.show_settings_for_model)
-        self.device_combo_box.currentTextChanged.connect(
-            self.set_load_in_4_bit_visibility)
-        self.toggle_advanced_settings_form_button.clicked.connect(
-            self.toggle_advanced_settings_form)
+        performance_rows = (
+            ('Batch size', self.batch_size_spin_box),
+            ('Compile model', self.compile_model_check_box),
+            ('GPU index', self.gpu_index_spin_box)
+        )
+        for label_text, widget in performance_rows:
+            advanced_settings_form.addRow(StaticTextLabel(label_text), widget)
         # Make sure the minimum new token count is less than or equal to the
         # maximum new token count.
         self.min_new_token_count_spin_box.valueChanged.connect(
             self.max_new_token_count_spin_box.setMinimum)
         self.max_new_token_count_spin_box.valueChanged.connect(
             self.min_new_token_count_spin_box.setMaximum)
-
-        self.show_settings_for_model(self.model_combo_box.currentText())
-        self.set_load_in_4_bit_visibility(self.device_combo_box.currentText())
-        if not self.is_bitsandbytes_available:
-            self.load_in_4_bit_check_box.setChecked(False)
-
-    def get_local_model_paths(self) -> list[str]:
-        models_directory_path = self.settings.value(
-            'models_directory_path',
-            defaultValue=DEFAULT_SETTINGS['models_directory_path'], type=str)
-        if not models_directory_path:
-            return []
-        models_directory_path = Path(models_directory_path)
-        print(f'Loading local auto-captioning model paths under '
-              f'{models_directory_path}...')
-        # Auto-captioning models have a `config.json` file.
-        config_paths = set(models_directory_path.glob('**/config.json'))
-        # WD Tagger models have a `selected_tags.csv` file.
-        selected_tags_paths = set(
-            models_directory_path.glob('**/selected_tags.csv'))
-        model_directory_paths = [str(path.parent) for path
-                                 in config_paths | selected_tags_paths]
-        model_directory_paths.sort()
-        print(f'Loaded {len(model_directory_paths)} model '
-              f'{pluralize("path", len(model_directory_paths))}.')
-        return model_directory_paths
-
-    @Slot(str)
-    def show_settings_for_model(self, model_id: str):
-        wd_tagger_widgets = [self.wd_tagger_settings_form_container]
-        non_wd_tagger_widgets = [
-            self.prompt_label,
-            self.prompt_text_edit,
-            self.caption_start_label,
-            self.caption_start_line_edit,
-            self.device_label,
-            self.device_combo_box,
-            self.load_in_4_bit_container,
-            self.remove_tag_separators_container,
-            self.horizontal_line,
-            self.toggle_advanced_settings_form_button,
-            self.advanced_settings_form_container
-        ]
-        is_wd_tagger_model = get_model_class(model_id) == WdTagger
-        for widget in wd_tagger_widgets:
-            widget.setVisible(is_wd_tagger_model)
-        for widget in non_wd_tagger_widgets:
-            widget.setVisible(not is_wd_tagger_model)
-        self.set_load_in_4_bit_visibility(self.device_combo_box.currentText())
-
-    @Slot(str)
-    def set_load_in_4_bit_visibility(self, device: str):
-        model_id = self.model_combo_box.currentText()
-        is_wd_tagger_model = get_model_class(model_id) == WdTagger
-        if is_wd_tagger_model:
-            self.load_in_4_bit_container.setVisible(False)
-            return
-        is_load_in_4_bit_available = (self.is_bitsandbytes_available
-                                      and device == CaptionDevice.GPU)
-        self.load_in_4_bit_container.setVisible(is_load_in_4_bit_available)
+        self.is_advanced_settings_form_built = True
 
     @Slot()
     def toggle_advanced_settings_form(self):
-        if self.advanced_settings_form_container.isHidden():
+        if not self.is_advanced_settings_form_shown:
+            if not self.is_advanced_settings_form_built:
+                self.build_advanced_settings_form()
+            self.is_advanced_settings_form_shown = True
             self.advanced_settings_form_container.show()
             self.toggle_advanced_settings_form_button.setText(
                 'Hide Advanced Settings')
         else:
+            self.is_advanced_settings_form_shown = False
             self.advanced_settings_form_container.hide()
             self.toggle_advanced_settings_form_button.setText(
                 'Show Advanced Settings')
 
+    def get_advanced_settings(self) -> dict:
+        if not self.is_advanced_settings_form_built:
+            return {
+                key: self.settings.value(key, default, type=type(default))
+                for key, default in ADVANCED_SETTINGS_DEFAULTS.items()
+            }
+        return {
+            'bad_words': self.bad_words_line_edit.text(),
+            'forced_words': self.forced_words_line_edit.text(),
+            'min_new_tokens': self.min_new_token_count_spin_box.value(),
+            'max_new_tokens': self.max_new_token_count_spin_box.value(),
+            'num_beams': self.beam_count_spin_box.value(),
+            'length_penalty': self.length_penalty_spin_box.value(),
+            'do_sample': self.use_sampling_check_box.isChecked(),
+            'temperature': self.temperature_spin_box.value(),
+            'top_k': self.top_k_spin_box.value(),
+            'top_p': self.top_p_spin_box.value(),
+            'repetition_penalty': self.repetition_penalty_spin_box.value(),
+            'no_repeat_ngram_size': self.no_repeat_ngram_size_spin_box.value(),
+            'batch_size': self.batch_size_spin_box.value(),
+            'compile_model': self.compile_model_check_box.isChecked(),
+            'gpu_index': self.gpu_index_spin_box.value()
+        }
+
+    def get_wd_tagger_settings(self) -> dict:
+        if not self.is_wd_tagger_settings_form_built:
+            return {
+                key: self.settings.value(f'wd_tagger_{key}', default,
+                                         type=type(default))
+                for key, default in WD_TAGGER_SETTINGS_DEFAULTS.items()
+            }
+        return {
+            'show_probabilities':
+                self.show_probabilities_check_box.isChecked(),
+            'min_probability': self.min_probability_spin_box.value(),
+            'max_tags': self.max_tags_spin_box.value(),
+            'tags_to_exclude': self.tags_to_exclude_text_edit.toPlainText()
+        }
+
     def get_caption_settings(self) -> dict:
+        advanced_settings = self.get_advanced_settings()
         return {
             'model_id': self.model_combo_box.currentText(),
             'prompt': self.prompt_text_edit.toPlainText(),
             'caption_start': self.caption_start_line_edit.text(),
             'caption_position': self.caption_position_combo_box.currentText(),
             'device': self.device_combo_box.currentText(),
-            'gpu_index': self.gpu_index_spin_box.value(),
-            'load_in_4_bit': self.load_in_4_bit_check_box.isChecked(),
+            'gpu_index': advanced_settings['gpu_index'],
+            'batch_size': advanced_settings['batch_size'],
+            'compile_model': advanced_settings['compile_model'],
+            'quantization': self.quantization_combo_box.currentText(),
             'remove_tag_separators':
                 self.remove_tag_separators_check_box.isChecked(),
-            'bad_words': self.bad_words_line_edit.text(),
-            'forced_words': self.forced_words_line_edit.text(),
+            'bad_words': advanced_settings['bad_words'],
+            'forced_words': advanced_settings['forced_words'],
             'generation_parameters': {
-                'min_new_tokens': self.min_new_token_count_spin_box.value(),
-                'max_new_tokens': self.max_new_token_count_spin_box.value(),
-                'num_beams': self.beam_count_spin_box.value(),
-                'length_penalty': self.length_penalty_spin_box.value(),
-                'do_sample': self.use_sampling_check_box.isChecked(),
-                'temperature': self.temperature_spin_box.value(),
-                'top_k': self.top_k_spin_box.value(),
-                'top_p': self.top_p_spin_box.value(),
-                'repetition_penalty': self.repetition_penalty_spin_box.value(),
-                'no_repeat_ngram_size':
-                    self.no_repeat_ngram_size_spin_box.value()
+                key: advanced_settings[key] for key in (
+                    'min_new_tokens', 'max_new_tokens', 'num_beams',
+                    'length_penalty', 'do_sample', 'temperature', 'top_k',
+                    'top_p', 'repetition_penalty', 'no_repeat_ngram_size')
             },
-            'wd_tagger_settings': {
-                'show_probabilities':
-                    self.show_probabilities_check_box.isChecked(),
-                'min_probability': self.min_probability_spin_box.value(),
-                'max_tags': self.max_tags_spin_box.value(),
-                'tags_to_exclude':
-                    self.tags_to_exclude_text_edit.toPlainText()
-            }
+            'wd_tagger_settings': self.get_wd_tagger_settings()
         }
 
 
-@Slot()
 def restore_stdout_and_stderr():
     sys.stdout = sys.__stdout__
     sys.stderr = sys.__stderr__
 
 
 class AutoCaptioner(QDockWidget):
-    caption_generated = Signal(QModelIndex, str, list)
+    captions_generated = Signal(list)
+    bitsandbytes_availability_checked = Signal(bool)
 
     def __init__(self, image_list_model: ImageListModel,
                  image_list: ImageList):
@@ -358,16 +671,41 @@ class AutoCaptioner(QDockWidget):
         self.image_list_model = image_list_model
         self.image_list = image_list
         self.settings = get_settings()
+        # Kept up to date by the settings dialog, so that the setting does not
+        # have to be read every time captioning is started.
+        self.models_directory_path: Path | None = None
+        self.set_models_directory_path(self.settings.value(
+            'models_directory_path',
+            defaultValue=DEFAULT_SETTINGS['models_directory_path'], type=str))
         self.is_captioning = False
         self.captioning_thread = None
         self.processor = None
         self.model = None
         self.model_id: str | None = None
-        self.model_device_type: str | None = None
-        self.is_model_loaded_in_4_bit = None
+        self.model_device: torch.device | None = None
+        self.model_quantization: CaptionQuantization | None = None
+        self.is_model_compiled = False
+        self.uncompiled_forward = None
+        # Decoded images are kept between captioning runs.
+        self.image_cache = ImageCache(size_limit=0)
+        self.set_image_cache_size(self.settings.value(
+            'image_cache_size',
+            defaultValue=DEFAULT_SETTINGS['image_cache_size'], type=int))
         # Whether the last block of text in the console text edit should be
         # replaced with the next block of text that is outputted.
         self.replace_last_console_text_edit_block = False
+        # Outputted text is buffered and added to the console text edit in
+        # batches because the models and progress bars can output many small
+        # chunks of text per second.
+        self.console_text_buffer: list[str] = []
+        # Whether the first buffered block of text should replace the last
+        # block of text in the console text edit.
+        self.console_text_buffer_replaces_last_block = False
+        self.console_flush_timer = QTimer(self)
+        self.console_flush_timer.setSingleShot(True)
+        self.console_flush_timer.setInterval(CONSOLE_FLUSH_INTERVAL)
+        self.console_flush_timer.timeout.connect(
+            self.flush_console_text_buffer)
 
         # Each `QDockWidget` needs a unique object name for saving its state.
         self.setObjectName('auto_captioner')
@@ -379,27 +717,97 @@ class AutoCaptioner(QDockWidget):
         self.progress_bar = QProgressBar()
         self.progress_bar.setFormat('%v / %m images captioned (%p%)')
         self.progress_bar.hide()
+        # The height of the console text edit is set when it is first shown.
         self.console_text_edit = QPlainTextEdit()
-        set_text_edit_height(self.console_text_edit, 4)
         self.console_text_edit.setReadOnly(True)
+        self.console_text_edit.setMaximumBlockCount(CONSOLE_MAX_BLOCK_COUNT)
         self.console_text_edit.hide()
         container = QWidget()
-        layout = QVBoxLayout(container)
-        layout.addWidget(self.start_cancel_button)
-        layout.addWidget(self.progress_bar)
-        layout.addWidget(self.console_text_edit)
-        self.caption_settings_form = CaptionSettingsForm()
-        layout.addLayout(self.caption_settings_form)
+        # An opaque container lets Qt skip painting the scroll area viewport
+        # behind it when the dock is resized or scrolled.
+        container.setAutoFillBackground(True)
+        self.container_layout = QVBoxLayout(container)
+        self.container_layout.addWidget(self.start_cancel_button)
+        self.container_layout.addWidget(self.progress_bar)
+        self.container_layout.addWidget(self.console_text_edit)
+        # The caption settings form is only built when the auto-captioner is
+        # first shown because building it can take a while.
+        self.caption_settings_form: CaptionSettingsForm | None = None
+        # The confirmation dialog for captioning multiple images is reused
+        # instead of being built again every time.
+        self.caption_multiple_images_dialog: (
+            CaptionMultipleImagesDialog | None) = None
+        # Finding the `bitsandbytes` package does not import it, so it is fast
+        # enough to do here. Whether it can actually be imported is checked in
+        # the background.
+        is_bitsandbytes_installed = (importlib.util.find_spec('bitsandbytes')
+                                     is not None)
+        self.is_bitsandbytes_available: bool | None = (
+            None if is_bitsandbytes_installed else False)
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
-        scroll_area.setSizeAdjustPolicy(
-            QAbstractScrollArea.SizeAdjustPolicy.AdjustToContents)
         scroll_area.setFrameShape(QFrame.Shape.NoFrame)
         scroll_area.setWidget(container)
         self.setWidget(scroll_area)
 
         self.start_cancel_button.clicked.connect(
             self.start_or_cancel_captioning)
+        if is_bitsandbytes_installed:
+            self.bitsandbytes_availability_checked.connect(
+                self.set_is_bitsandbytes_available)
+            QThreadPool.globalInstance().start(
+                self.check_bitsandbytes_availability)
+
+    def showEvent(self, event: QShowEvent):
+        self.get_caption_settings_form()
+        super().showEvent(event)
+
+    def check_bitsandbytes_availability(self):
+        """
+        Check whether `bitsandbytes` can be imported. This is run in a
+        background thread because importing it loads the CUDA libraries,
+        which can take a while.
+        """
+        try:
+            import bitsandbytes
+            is_bitsandbytes_available = True
+        except (ImportError, RuntimeError):
+            is_bitsandbytes_available = False
+        self.bitsandbytes_availability_checked.emit(is_bitsandbytes_available)
+
+    @Slot(bool)
+    def set_is_bitsandbytes_available(self, is_bitsandbytes_available: bool):
+        self.is_bitsandbytes_available = is_bitsandbytes_available
+        if self.caption_settings_form is not None:
+            self.caption_settings_form.set_is_bitsandbytes_available(
+                is_bitsandbytes_available)
+
+    def get_caption_settings_form(self) -> CaptionSettingsForm:
+        if self.caption_settings_form is None:
+            self.caption_settings_form = CaptionSettingsForm(
+                self.is_bitsandbytes_available)
+            self.container_layout.addLayout(self.caption_settings_form)
+        return self.caption_settings_form
+
+    def get_caption_multiple_images_dialog(
+            self, selected_image_count: int) -> CaptionMultipleImagesDialog:
+        if self.caption_multiple_images_dialog is None:
+            self.caption_multiple_images_dialog = CaptionMultipleImagesDialog(
+                selected_image_count)
+        else:
+            self.caption_multiple_images_dialog.set_selected_image_count(
+                selected_image_count)
+        return self.caption_multiple_images_dialog
+
+    @Slot(int)
+    def set_image_cache_size(self, image_cache_size: int):
+        """Set the size limit of the image cache in MiB."""
+        self.image_cache.set_size_limit(image_cache_size * 1024 * 1024)
+
+    @Slot(str)
+    def set_models_directory_path(self, models_directory_path: str):
+        self.models_directory_path = (Path(models_directory_path)
+                                      if models_directory_path else None)
 
     @Slot()
     def start_or_cancel_captioning(self):
@@ -427,19 +835,55 @@ class AutoCaptioner(QDockWidget):
         text = text.strip()
         if not text:
             return
-        if self.console_text_edit.isHidden():
-            self.console_text_edit.show()
         if self.replace_last_console_text_edit_block:
             self.replace_last_console_text_edit_block = False
-            # Select and remove the last block of text.
-            self.console_text_edit.moveCursor(QTextCursor.MoveOperation.End)
-            self.console_text_edit.moveCursor(
-                QTextCursor.MoveOperation.StartOfBlock,
-                QTextCursor.MoveMode.KeepAnchor)
-            self.console_text_edit.textCursor().removeSelectedText()
+            if self.console_text_buffer:
+                self.console_text_buffer[-1] = text
+                return
+            self.console_text_buffer_replaces_last_block = True
+        self.console_text_buffer.append(text)
+        if not self.console_flush_timer.isActive():
+            self.console_flush_timer.start()
+
+    @Slot()
+    def flush_console_text_buffer(self):
+        if not self.console_text_buffer:
+            return
+        if self.console_text_edit.isHidden():
+            set_text_edit_height(self.console_text_edit, 4)
+            self.console_text_edit.show()
+        if self.console_text_buffer_replaces_last_block:
+            self.console_text_buffer_replaces_last_block = False
+            # Select and remove the last block of text in a single edit with
+            # one cursor.
+            text_cursor = QTextCursor(self.console_text_edit.document())
+            text_cursor.beginEditBlock()
+            text_cursor.movePosition(QTextCursor.MoveOperation.End)
+            text_cursor.movePosition(QTextCursor.MoveOperation.StartOfBlock,
+                                     QTextCursor.MoveMode.KeepAnchor)
+            text_cursor.removeSelectedText()
             # Delete the newline.
-            self.console_text_edit.textCursor().deletePreviousChar()
-        self.console_text_edit.appendPlainText(text)
+            text_cursor.deletePreviousChar()
+            text_cursor.endEditBlock()
+        self.console_text_edit.appendPlainText(
+            '\n'.join(self.console_text_buffer))
+        self.console_text_buffer.clear()
+
+    @Slot()
+    def clear_console_text_edit(self):
+        self.console_text_buffer.clear()
+        self.console_text_buffer_replaces_last_block = False
+        self.console_text_edit.clear()
+
+    @Slot()
+    def finish_captioning(self):
+        self.set_is_captioning(False)
+        # Emit any output that does not end with a newline.
+        self.captioning_thread.flush()
+        restore_stdout_and_stderr()
+        self.flush_console_text_buffer()
+        self.progress_bar.hide()
+        self.start_cancel_button.setEnabled(True)
 
     @Slot()
     def show_alert(self):
@@ -463,7 +907,7 @@ class AutoCaptioner(QDockWidget):
         selected_image_count = len(selected_image_indices)
         show_alert_when_finished = False
         if selected_image_count > 1:
-            confirmation_dialog = CaptionMultipleImagesDialog(
+            confirmation_dialog = self.get_caption_multiple_images_dialog(
                 selected_image_count)
             reply = confirmation_dialog.exec()
             if reply != QMessageBox.StandardButton.Yes:
@@ -471,7 +915,8 @@ class AutoCaptioner(QDockWidget):
             show_alert_when_finished = (confirmation_dialog
                                         .show_alert_check_box.isChecked())
         self.set_is_captioning(True)
-        caption_settings = self.caption_settings_form.get_caption_settings()
+        caption_settings = (self.get_caption_settings_form()
+                            .get_caption_settings())
         if caption_settings['caption_position'] != CaptionPosition.DO_NOT_ADD:
             self.image_list_model.add_to_undo_stack(
                 action_name=f'Generate '
@@ -482,28 +927,18 @@ class AutoCaptioner(QDockWidget):
             self.progress_bar.setValue(0)
             self.progress_bar.show()
         tag_separator = get_tag_separator()
-        models_directory_path = self.settings.value(
-            'models_directory_path',
-            defaultValue=DEFAULT_SETTINGS['models_directory_path'], type=str)
-        models_directory_path = (Path(models_directory_path)
-                                 if models_directory_path else None)
         self.captioning_thread = CaptioningThread(
             self, self.image_list_model, selected_image_indices,
-            caption_settings, tag_separator, models_directory_path)
+            caption_settings, tag_separator, self.models_directory_path)
         self.captioning_thread.text_outputted.connect(
             self.update_console_text_edit)
         self.captioning_thread.clear_console_text_edit_requested.connect(
-            self.console_text_edit.clear)
-        self.captioning_thread.caption_generated.connect(
-            self.caption_generated)
+            self.clear_console_text_edit, Qt.ConnectionType.QueuedConnection)
+        self.captioning_thread.captions_generated.connect(
+            self.captions_generated)
         self.captioning_thread.progress_bar_update_requested.connect(
-            self.progress_bar.setValue)
-        self.captioning_thread.finished.connect(
-            lambda: self.set_is_captioning(False))
-        self.captioning_thread.finished.connect(restore_stdout_and_stderr)
-        self.captioning_thread.finished.connect(self.progress_bar.hide)
-        self.captioning_thread.finished.connect(
-            lambda: self.start_cancel_button.setEnabled(True))
+            self.progress_bar.setValue, Qt.ConnectionType.QueuedConnection)
+        self.captioning_thread.finished.connect(self.finish_captioning)
         if show_alert_when_finished:
             self.captioning_thread.finished.connect(self.show_alert)
         # Redirect `stdout` and `stderr` so that the outputs are displayed in
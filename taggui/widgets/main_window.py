@@ -258,6 +258,10 @@ class MainWindow(QMainWindow):
     @Slot()
     def show_settings_dialog(self):
         settings_dialog = SettingsDialog(parent=self)
+        settings_dialog.models_directory_line_edit.textChanged.connect(
+            self.auto_captioner.set_models_directory_path)
+        settings_dialog.image_cache_size_spin_box.valueChanged.connect(
+            self.auto_captioner.set_image_cache_size)
         settings_dialog.exec()
 
     @Slot()
@@ -543,14 +547,20 @@ class MainWindow(QMainWindow):
             lambda: self.toggle_all_tags_editor_action.setChecked(
                 self.all_tags_editor.isVisible()))
 
+    @Slot(list)
+    def update_generated_captions_tags(
+            self, generated_captions: list[tuple[QModelIndex, str, list]]):
+        self.image_list_model.update_images_tags(
+            [(image_index, tags)
+             for image_index, _, tags in generated_captions])
+        image_indices = [image_index for image_index, *_ in generated_captions]
+        self.image_tags_editor.reload_image_tags_if_changed(
+            min(image_indices, key=lambda index: index.row()),
+            max(image_indices, key=lambda index: index.row()))
+
     def connect_auto_captioner_signals(self):
-        self.auto_captioner.caption_generated.connect(
-            lambda image_index, _, tags:
-            self.image_list_model.update_image_tags(image_index, tags))
-        self.auto_captioner.caption_generated.connect(
-            lambda image_index, *_:
-            self.image_tags_editor.reload_image_tags_if_changed(image_index,
-                                                                image_index))
+        self.auto_captioner.captions_generated.connect(
+            self.update_generated_captions_tags)
         self.auto_captioner.visibilityChanged.connect(
             lambda: self.toggle_auto_captioner_action.setChecked(
                 self.auto_captioner.isVisible()))